@@ -1,31 +1,26 @@
 import logging
 import os
-import re
 import sys
 
 import importlib.resources
 
 from colorama import Fore, Style, init
-from PyQt5.QtCore import QSize, Qt, pyqtSignal
-from PyQt5.QtGui import QFontMetrics, QPixmap, QTransform, QIcon
+from PyQt5.QtCore import QSize, Qt, QThreadPool
+from PyQt5.QtGui import QPixmap, QIcon
 from PyQt5.QtWidgets import (
     QApplication,
     QFileDialog,
-    QFrame,
-    QHBoxLayout,
     QLabel,
-    QLineEdit,
     QMainWindow,
     QMessageBox,
-    QScrollArea,
-    QSizePolicy,
     QTabWidget,
     QVBoxLayout,
     QWidget,
 )
 
-from . import exiftool, extra_data, location, weather
-from .earth import EarthWidget
+from . import exiftool, extra_data, fastexif, loader, location, preview, weather
+from .earth import EarthWidget, load_texture
+from .table import PropertyTable, PropertyTableModel
 
 READ_ONLY_KEYS = {
     "Source File",
@@ -66,15 +61,24 @@ handler.setFormatter(ColorFormatter("%(asctime)s [%(levelname)s] %(message)s"))
 logging.basicConfig(level=logging.INFO, handlers=[handler])
 
 
-class ClickableLabel(QLabel):
-    clicked = pyqtSignal()
-
-    def mouseDoubleClickEvent(self, event):
-        self.clicked.emit()
-        super().mouseDoubleClickEvent(event)
+TRUNCATION_LENGTH = 30
+VALID_EXTENSIONS = (".jpg", ".jpeg", ".png")
+LOADING_TEXT = "Loading..."
+UNAVAILABLE_TEXT = "Unavailable"
+# files on each side of the current one whose thumbnails are generated ahead
+PREFETCH_DISTANCE = 2
 
 
-TRUNCATION_LENGTH = 30
+def list_folder(folder):
+    """Supported files in `folder`, sorted; runs off the GUI thread."""
+    try:
+        names = sorted(
+            name for name in os.listdir(folder)
+            if name.lower().endswith(VALID_EXTENSIONS)
+        )
+    except OSError:
+        return []
+    return [os.path.join(folder, name) for name in names]
 
 class MetaView(QMainWindow):
     def __init__(self, file_path=None):
@@ -84,6 +88,21 @@ class MetaView(QMainWindow):
         with importlib.resources.path("metaview.assets", "MetaView128.png") as icon_path:
             self.setWindowIcon(QIcon(str(icon_path)))
 
+        self.thread_pool = QThreadPool()
+        # one metadata read at a time, so superseded reads can still be dequeued
+        self.metadata_pool = QThreadPool()
+        self.metadata_pool.setMaxThreadCount(1)
+        self.generation = 0
+        self.load_token = None
+        self.load_tasks = []
+        # every started task, kept alive until its run() is over
+        self.running_tasks = set()
+        # folder -> list_folder() result, refreshed in the background on each load
+        self.folder_listing = {}
+        self.tables = {}
+        # build or map the city index now rather than on the first GPS photo
+        location.preload()
+
         label = QLabel("Open a file to get started.")
         label.setAlignment(Qt.AlignCenter)
 
@@ -110,6 +129,14 @@ class MetaView(QMainWindow):
         delete_metadata_action.setShortcut("Ctrl+Del")
         delete_metadata_action.triggered.connect(self.delete_metadata)
 
+        previous_action = file_menu.addAction("Previous File")
+        previous_action.setShortcut("Alt+Left")
+        previous_action.triggered.connect(lambda: self.open_adjacent(-1))
+
+        next_action = file_menu.addAction("Next File")
+        next_action.setShortcut("Alt+Right")
+        next_action.triggered.connect(lambda: self.open_adjacent(1))
+
         self.setCentralWidget(label)
 
         if file_path:
@@ -125,14 +152,134 @@ class MetaView(QMainWindow):
         if not self.file_path or not os.path.exists(self.file_path):
             return
         
-        valid_exts = (".jpg", ".jpeg", ".png")
-        if not self.file_path.lower().endswith(valid_exts):
+        if not self.file_path.lower().endswith(VALID_EXTENSIONS):
             self.display_error("Only .jpg, .jpeg, and .png files are supported (More are to be tested).")
             return
 
         logging.info(f"Selected File: {self.file_path}")
 
-        self.metadata = exiftool.get_metadata(self.file_path)
+        self.cancel_load()
+        self.generation += 1
+        self.load_token = loader.CancelToken(self.generation)
+
+        label = QLabel(LOADING_TEXT)
+        label.setAlignment(Qt.AlignCenter)
+        self.setCentralWidget(label)
+        self.tables = {}
+
+        self.run_task(
+            self.on_metadata_loaded,
+            self.on_metadata_failed,
+            fastexif.get_metadata,
+            self.file_path,
+            pool=self.metadata_pool,
+        )
+
+    def cancel_load(self):
+        """Drop everything the current load still has queued or in flight."""
+        if self.load_token is not None:
+            self.load_token.cancel()
+        for pool, task in self.load_tasks:
+            # a taken task never runs, so it won't report done either
+            if pool.tryTake(task):
+                self.running_tasks.discard(task)
+        self.load_tasks = []
+
+    def run_task(self, on_finished, on_failed, fn, *args, pool=None):
+        pool = pool or self.thread_pool
+        token = self.load_token
+        task = loader.Task(fn, *args, token=token)
+
+        # results of a superseded load must not touch the current one
+        def finished(result):
+            if token is self.load_token:
+                on_finished(result)
+
+        def failed(error):
+            if token is self.load_token:
+                on_failed(error)
+
+        task.signals.finished.connect(finished)
+        task.signals.failed.connect(failed)
+        task.signals.done.connect(self.running_tasks.discard)
+        self.running_tasks.add(task)
+        self.load_tasks.append((pool, task))
+        pool.start(task)
+        return task
+
+    def current_folder(self):
+        file_path = getattr(self, "file_path", None)
+        return os.path.dirname(os.path.abspath(file_path)) if file_path else None
+
+    def folder_files(self):
+        """Listed files next to the current one and its index among them.
+
+        Returns (None, -1) while the folder hasn't been listed yet.
+        """
+        files = self.folder_listing.get(self.current_folder())
+        if files is None:
+            return None, -1
+        file_path = os.path.abspath(self.file_path)
+        return files, files.index(file_path) if file_path in files else -1
+
+    def list_current_folder(self, on_listed):
+        """List the current folder in the background, then call `on_listed()`."""
+        folder = self.current_folder()
+        if folder is None:
+            return
+
+        def listed(files):
+            self.folder_listing[folder] = files
+            on_listed()
+
+        self.run_task(listed, lambda error: None, list_folder, folder)
+
+    def open_adjacent(self, step):
+        files, index = self.folder_files()
+        if files is None:
+            self.list_current_folder(lambda: self.open_adjacent(step))
+            return
+        if not files:
+            return
+        self.open_file(files[(index + step) % len(files)])
+
+    def prefetch_nearby(self):
+        """Warm the caches for this file and those Previous/Next lead to."""
+        # also picks up files added to the folder since it was last listed
+        self.list_current_folder(self.prefetch_listed)
+
+    def prefetch_listed(self):
+        files, index = self.folder_files()
+        if index < 0:
+            return
+        # the preview only made its own size, fill in the others first
+        nearby = [files[index]]
+        for distance in range(1, PREFETCH_DISTANCE + 1):
+            for step in (distance, -distance):
+                if 0 <= index + step < len(files):
+                    nearby.append(files[index + step])
+        self.run_task(
+            lambda result: None,
+            lambda error: None,
+            preview.prefetch,
+            nearby,
+            self.load_token,
+        )
+        # only files the in-process reader can't handle reach exiftool (and its cache)
+        if len(nearby) > 1:
+            self.run_task(
+                lambda result: None,
+                lambda error: None,
+                fastexif.get_metadata_many,
+                nearby[1:],
+            )
+
+    def on_metadata_failed(self, error):
+        self.setCentralWidget(QLabel("Open a file to get started."))
+        self.display_error(f"Could not read metadata: {error}")
+
+    def on_metadata_loaded(self, metadata):
+        self.metadata = metadata
         self.original_backend_keys = set(self.metadata.keys())
         self.original_values = {}
 
@@ -147,11 +294,10 @@ class MetaView(QMainWindow):
             self.metadata["GPSSpeed"] = round(
                 self.metadata["GPSSpeed"], 2
             )
+        embedded_tags = tuple(tag for tag in preview.EMBEDDED_TAGS if tag in self.metadata)
         if "ThumbnailImage" in self.metadata:
             del self.metadata["ThumbnailImage"]
 
-        self.categories_dict = extra_data.categories_dict
-
         self.categories = self.categorize_metadata(self.metadata)
 
         for cat, items in self.categories.items():
@@ -161,23 +307,65 @@ class MetaView(QMainWindow):
                     if backend_key:
                         self.original_values[backend_key] = value
 
-        # add preview image
-        image_label = QLabel()
-        pixmap = QPixmap(self.file_path)
-
-        if "Orientation" in self.metadata:
-            orientation = self.metadata["Orientation"]
-            logging.debug(f"Orientation: {orientation}")
-            re_result = re.findall(r"(\d+)", str(orientation))
-            if len(re_result):
-                orientation = int(re_result[0])
-                im_transform = QTransform()
-                im_transform.rotate(90)
-                pixmap = pixmap.transformed(im_transform)
+        # the preview is decoded at display size on a worker
+        self.add_property("General", "Image Preview", QLabel(LOADING_TEXT))
+        self.run_task(
+            self.on_preview_loaded,
+            lambda error: self.set_property("General", "Image Preview", QLabel(UNAVAILABLE_TEXT)),
+            preview.get_thumbnail,
+            self.file_path,
+            self.metadata.get("Orientation"),
+            embedded_tags,
+        )
+
+        # location, weather and the globe fill in as their workers finish
+        if "GPSLatitude" in self.metadata and "GPSLongitude" in self.metadata:
+            GPSLatitude = self.metadata["GPSLatitude"]
+            GPSLongitude = self.metadata["GPSLongitude"]
+            GPSLatitude = location.convert_dms(GPSLatitude)
+            GPSLongitude = location.convert_dms(GPSLongitude)
+
+            self.add_property("Location", "Location", LOADING_TEXT)
+            self.add_property("Location", "Earth View", QLabel(LOADING_TEXT))
+            self.run_task(
+                self.on_location_loaded,
+                lambda error: self.set_property("Location", "Location", UNAVAILABLE_TEXT),
+                location.get_location,
+                GPSLatitude,
+                GPSLongitude,
+            )
+            self.run_task(
+                lambda texture: self.on_texture_loaded(texture, GPSLatitude, GPSLongitude),
+                lambda error: self.set_property("Location", "Earth View", QLabel(UNAVAILABLE_TEXT)),
+                load_texture,
+            )
 
+            if "DateTimeOriginal" in self.metadata:
+                self.add_property("Date && Time", "Temperature", LOADING_TEXT)
+                self.add_property("Date && Time", "Weather", LOADING_TEXT)
+                self.run_task(
+                    self.on_weather_loaded,
+                    lambda error: self.on_weather_loaded((UNAVAILABLE_TEXT, UNAVAILABLE_TEXT)),
+                    weather.get_weather,
+                    self.metadata["DateTimeOriginal"],
+                    GPSLatitude,
+                    GPSLongitude,
+                    self.load_token,
+                )
+
+        self.build_tabs()
+        new_title = self.file_path
+        if len(new_title) >= TRUNCATION_LENGTH:
+            new_title = "..." + new_title[-TRUNCATION_LENGTH:]
+        new_title = f"MetaView ({new_title})"
+        self.setWindowTitle(new_title)
+
+    def on_preview_loaded(self, image):
+        image_label = QLabel()
+        pixmap = QPixmap.fromImage(image)
         image_label.setPixmap(pixmap)
         image_label.setScaledContents(True)
-        max_height = 128
+        max_height = preview.PREVIEW_HEIGHT
         image_label.setMaximumHeight(max_height)
 
         if not pixmap.isNull():
@@ -187,192 +375,70 @@ class MetaView(QMainWindow):
         else:
             image_label.setMaximumWidth(max_height)  # fallback if pixmap is invalid
 
-        self.add_property("General", "Image Preview", image_label)
+        self.set_property("General", "Image Preview", image_label)
+        self.prefetch_nearby()
 
-        # add location as text
-        if "GPSLatitude" in self.metadata and "GPSLongitude" in self.metadata:
-            GPSLatitude = self.metadata["GPSLatitude"]
-            GPSLongitude = self.metadata["GPSLongitude"]
-            GPSLatitude = location.convert_dms(GPSLatitude)
-            GPSLongitude = location.convert_dms(GPSLongitude)
+    def on_location_loaded(self, result):
+        city, region, country = result
+        self.set_property("Location", "Location", f"{city}, {region}, {country}")
 
-            city, region, country = location.get_location(GPSLatitude, GPSLongitude)
+    def on_texture_loaded(self, texture, lat, lon):
+        earth_widget = EarthWidget(lat, lon, texture)
+        earth_widget.setMaximumHeight(256)
+        self.set_property("Location", "Earth View", earth_widget)
 
-            location_str = f"{city}, {region}, {country}"
-
-            self.add_property("Location", "Location", location_str)
-
-            earth_widget = EarthWidget(GPSLatitude, GPSLongitude)
-            earth_widget.setMaximumHeight(256)
-            self.add_property("Location", "Earth View", earth_widget)
-
-            if "DateTimeOriginal" in self.metadata:
-                temperature, weather_str = weather.get_weather(
-                    self.metadata["DateTimeOriginal"], GPSLatitude, GPSLongitude
-                )
-
-                self.add_property("Date && Time", "Temperature", temperature)
-                self.add_property("Date && Time", "Weather", weather_str)
+    def on_weather_loaded(self, result):
+        temperature, weather_str = result
+        self.set_property("Date && Time", "Temperature", temperature)
+        self.set_property("Date && Time", "Weather", weather_str)
 
+    def build_tabs(self):
+        # tabs start empty, a table is only built the first time its tab is shown
+        self.tables = {}
+        self.tab_categories = list(self.categories)
         tab_widget = QTabWidget()
-        for category, items in self.categories.items():
-            widget = QWidget()
-            layout = QVBoxLayout()
-            layout.setSpacing(0)
+        for category in self.tab_categories:
+            container = QWidget()
+            layout = QVBoxLayout(container)
             layout.setContentsMargins(0, 0, 0, 0)
-
-            # Header
-            layoutH = QHBoxLayout()
-            label1 = QLabel(" Property")
-            label2 = QLabel("   Value")
-            label1.setStyleSheet("font-weight: bold; font-size: 15px;")
-            label2.setStyleSheet("font-weight: bold; font-size: 15px;")
-            label1.setFixedWidth(200)
-            layoutH.addWidget(label1, alignment=Qt.AlignVCenter)
-            layoutH.addWidget(label2, alignment=Qt.AlignVCenter)
-            layout.addLayout(layoutH)
-            line = QFrame()
-            line.setFrameShape(QFrame.HLine)
-            line.setFrameShadow(QFrame.Sunken)
-            line.setStyleSheet("color: gray; background-color: gray;")
-            line.setFixedHeight(2)
-            layout.addWidget(line)
-
-            def make_label(text, layoutH, key, cat=category):  # Capture category
-                label = ClickableLabel(text)
-                label.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
-
-                def on_label_clicked():
-                    if key in READ_ONLY_KEYS:
-                        self.display_error("You can't edit this.")
-                        return
-                    line_edit = QLineEdit(label.text())
-                    line_edit.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
-
-                    # adaptive width
-                    def adjust_width():
-                        fm = QFontMetrics(line_edit.font())
-                        text_width = fm.horizontalAdvance(line_edit.text() or " ")
-                        line_edit.setMinimumWidth(text_width + 20)
-
-                    line_edit.textChanged.connect(adjust_width)
-                    adjust_width()
-
-                    idx = layoutH.indexOf(label)
-                    layoutH.removeWidget(label)
-                    label.deleteLater()
-                    layoutH.insertWidget(
-                        idx, line_edit, 1, alignment=Qt.AlignLeft | Qt.AlignVCenter
-                    )
-
-                    def finish_edit():
-                        new_text = line_edit.text()
-                        # Update the categories data structure
-                        self.categories[cat][key] = new_text
-
-                        new_label = make_label(new_text, layoutH, key, cat)
-                        layoutH.removeWidget(line_edit)
-                        line_edit.deleteLater()
-                        layoutH.insertWidget(
-                            idx, new_label, 1, alignment=Qt.AlignLeft | Qt.AlignVCenter
-                        )
-
-                    line_edit.editingFinished.connect(finish_edit)
-                    line_edit.setFocus()
-
-                label.clicked.connect(on_label_clicked)
-                return label
-
-            for key, value in items.items():
-                row_widget = QWidget()
-                row_layout = QVBoxLayout()
-                row_layout.setSpacing(0)
-                row_layout.setContentsMargins(0, 0, 0, 0)
-
-                layoutH = QHBoxLayout()
-                layoutH.setSpacing(10)
-                layoutH.setContentsMargins(8, 0, 8, 0)
-                label1 = QLabel(str(key))
-                label1.setFixedWidth(200)
-                layoutH.addWidget(label1, alignment=Qt.AlignVCenter)
-
-                if isinstance(value, QWidget):
-                    value.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
-                    layoutH.addWidget(
-                        value, 1, alignment=Qt.AlignLeft | Qt.AlignVCenter
-                    )
-                else:
-                    label2 = make_label(str(value), layoutH, key)
-                    layoutH.addWidget(
-                        label2, 1, alignment=Qt.AlignLeft | Qt.AlignVCenter
-                    )
-
-                row_layout.addLayout(layoutH)
-
-                line = QFrame()
-                line.setFrameShape(QFrame.HLine)
-                line.setFrameShadow(QFrame.Sunken)
-                line.setStyleSheet("color: gray; background-color: gray;")
-                line.setFixedHeight(1)
-                row_layout.addWidget(line)
-
-                row_widget.setLayout(row_layout)
-                row_widget.setMinimumHeight(32)
-                layout.addWidget(row_widget)
-
-            layout.addStretch()
-            widget.setLayout(layout)
-            scroll = QScrollArea()
-            scroll.setWidgetResizable(True)
-            scroll.setWidget(widget)
-            tab_widget.addTab(scroll, category)
+            tab_widget.addTab(container, category)
+        tab_widget.currentChanged.connect(
+            lambda index: self.ensure_tab(tab_widget, index)
+        )
+        self.ensure_tab(tab_widget, tab_widget.currentIndex())
 
         self.setCentralWidget(tab_widget)
-        new_title = self.file_path
-        if len(new_title) >= TRUNCATION_LENGTH:
-            new_title = "..." + new_title[-TRUNCATION_LENGTH:]
-        new_title = f"MetaView ({new_title})"
-        self.setWindowTitle(new_title)
+
+    def ensure_tab(self, tab_widget, index):
+        if index < 0 or index >= len(self.tab_categories):
+            return
+        category = self.tab_categories[index]
+        if category in self.tables:
+            return
+        model = PropertyTableModel(self.categories[category], READ_ONLY_KEYS)
+        view = PropertyTable(model)
+        view.doubleClicked.connect(
+            lambda index, model=model: self.on_value_double_clicked(model, index)
+        )
+        self.tables[category] = view
+        tab_widget.widget(index).layout().addWidget(view)
+
+    def on_value_double_clicked(self, model, index):
+        if index.column() == 1 and model.key(index.row()) in READ_ONLY_KEYS:
+            self.display_error("You can't edit this.")
+
+    def set_property(self, category, property, value):
+        """Update a property and redraw just its row."""
+        self.update_property(category, property, value)
+        view = self.tables.get(str(category))
+        if view is None:
+            return
+        row = view.model().refresh(str(property))
+        if row >= 0:
+            view.show_widget(row)
 
     def categorize_metadata(self, metadata):
-        categories = {cat: {} for cat in self.categories_dict}
-        display_to_backend = {cat: {} for cat in self.categories_dict}
-        uncategorized = {}
-        uncategorized_map = {}
-
-        for key, value in metadata.items():
-            display_key = extra_data.rename_dict.get(key, key)
-            found = False
-            for cat, keys in self.categories_dict.items():
-                if key in keys:
-                    # unique display keys
-                    orig_display_key = display_key
-                    i = 1
-                    while display_key in categories[cat]:
-                        display_key = f"{orig_display_key} ({i})"
-                        i += 1
-                    categories[cat][display_key] = value
-                    display_to_backend[cat][display_key] = key
-                    found = True
-                    break
-            if not found:
-                orig_display_key = display_key
-                i = 1
-                while display_key in uncategorized:
-                    display_key = f"{orig_display_key} ({i})"
-                    i += 1
-                uncategorized[display_key] = value
-                uncategorized_map[display_key] = key
-
-        if uncategorized:
-            categories["Other"] = uncategorized
-            display_to_backend["Other"] = uncategorized_map
-
-        categories = {cat: items for cat, items in categories.items() if items}
-        display_to_backend = {
-            cat: items for cat, items in display_to_backend.items() if items
-        }
-        self.display_to_backend = display_to_backend
+        categories, self.display_to_backend = extra_data.categorize_metadata(metadata)
         return categories
 
     def add_property(self, category, property, value):
@@ -427,6 +493,9 @@ class MetaView(QMainWindow):
         new_data = {}
         for cat, items in self.categories.items():
             for display_key, value in items.items():
+                # binary tags only hold a "(Binary data ...)" placeholder, see binary_tags
+                if exiftool.binary_size(value) is not None:
+                    continue
                 # only update strings
                 if isinstance(value, (str, int, float)):
                     backend_key = self.display_to_backend.get(cat, {}).get(display_key)
@@ -458,11 +527,26 @@ class MetaView(QMainWindow):
                         )
         return new_data
 
+    def binary_tags(self):
+        """Writable tags that were read as binary placeholders."""
+        return [
+            key
+            for key, value in self.metadata.items()
+            if exiftool.binary_size(value) is not None
+            and key in self.original_backend_keys
+            and key not in READ_ONLY_KEYS
+        ]
+
     def save_metadata(self, everything=False, save_path=None):
         logging.info("Saving new metadata...")
         new_data = self.pre_save(everything=everything)
         if save_path:
             result = exiftool.write_metadata(save_path, new_data)
+            if everything:
+                # the data itself never left exiftool, have it copy the tags
+                logging.info(
+                    exiftool.copy_tags(self.file_path, save_path, self.binary_tags())
+                )
         else:
             result = exiftool.write_metadata(self.file_path, new_data)
         logging.info(result)
@@ -485,6 +569,8 @@ class MetaView(QMainWindow):
 
     def quit(self):
         logging.info("Quitting...")
+        self.cancel_load()
+        exiftool.shutdown()
         sys.exit(0)
 
 
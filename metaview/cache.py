@@ -0,0 +1,259 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import appdirs
+
+CACHE_DIR = appdirs.user_cache_dir("metaview")
+
+
+def _connect(path, filename):
+    if path is None:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        path = os.path.join(CACHE_DIR, filename)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return path, conn
+
+
+class BlobCache:
+    """SQLite store of one blob per (file, variant), least recently used evicted.
+
+    An entry is only returned while the file's inode, size and mtime_ns
+    still match, and the least recently used entries are evicted once the
+    stored data grows past `max_bytes`. Subclasses pick the file name and
+    how values are turned into bytes.
+    """
+
+    FILENAME = None
+    TABLE = None
+
+    def __init__(self, path=None, max_bytes=64 * 1024 * 1024):
+        self.path, self._conn = _connect(path, self.FILENAME)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn.execute(f"""CREATE TABLE IF NOT EXISTS {self.TABLE} (
+                path TEXT NOT NULL,
+                variant TEXT NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                nbytes INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (path, variant)
+            )""")
+        self._conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.TABLE}_last_used ON {self.TABLE} (last_used)"
+        )
+        self._total = self._conn.execute(
+            f"SELECT COALESCE(SUM(nbytes), 0) FROM {self.TABLE}"
+        ).fetchone()[0]
+
+    def _encode(self, value):
+        return value
+
+    def _decode(self, data):
+        return data
+
+    def get(self, file_path, variant=""):
+        file_path = os.path.abspath(file_path)
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT inode, size, mtime_ns, data FROM {self.TABLE}"
+                " WHERE path = ? AND variant = ?",
+                (file_path, variant),
+            ).fetchone()
+            if row is None:
+                return None
+            if tuple(row[:3]) != (st.st_ino, st.st_size, st.st_mtime_ns):
+                self._delete(file_path, variant)
+                return None
+            self._conn.execute(
+                f"UPDATE {self.TABLE} SET last_used = ? WHERE path = ? AND variant = ?",
+                (time.time(), file_path, variant),
+            )
+        return self._decode(row[3])
+
+    def put(self, file_path, variant, value, st=None):
+        """Store `value`, `st` is the os.stat taken before it was read."""
+        file_path = os.path.abspath(file_path)
+        try:
+            st = st or os.stat(file_path)
+        except OSError:
+            return
+        data = self._encode(value)
+        with self._lock:
+            self._delete(file_path, variant)
+            self._conn.execute(
+                f"INSERT INTO {self.TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    file_path,
+                    variant,
+                    st.st_ino,
+                    st.st_size,
+                    st.st_mtime_ns,
+                    data,
+                    len(data),
+                    time.time(),
+                ),
+            )
+            self._total += len(data)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def contains(self, file_path, variant=""):
+        """Whether an up to date entry exists, without touching its LRU position."""
+        file_path = os.path.abspath(file_path)
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return False
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT inode, size, mtime_ns FROM {self.TABLE} WHERE path = ? AND variant = ?",
+                (file_path, variant),
+            ).fetchone()
+        return row is not None and tuple(row) == (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def invalidate(self, file_path):
+        file_path = os.path.abspath(file_path)
+        with self._lock:
+            for (variant,) in self._conn.execute(
+                f"SELECT variant FROM {self.TABLE} WHERE path = ?", (file_path,)
+            ).fetchall():
+                self._delete(file_path, variant)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.TABLE}")
+            self._total = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _delete(self, file_path, variant):
+        row = self._conn.execute(
+            f"SELECT nbytes FROM {self.TABLE} WHERE path = ? AND variant = ?",
+            (file_path, variant),
+        ).fetchone()
+        if row:
+            self._conn.execute(
+                f"DELETE FROM {self.TABLE} WHERE path = ? AND variant = ?",
+                (file_path, variant),
+            )
+            self._total -= row[0]
+
+    def _evict(self):
+        # drop down to 90% so we don't evict on every single put
+        target = self.max_bytes * 0.9
+        while self._total > target:
+            rows = self._conn.execute(
+                f"SELECT path, variant FROM {self.TABLE} ORDER BY last_used LIMIT 100"
+            ).fetchall()
+            if not rows:
+                self._total = 0
+                break
+            for path, variant in rows:
+                self._delete(path, variant)
+                if self._total <= target:
+                    break
+        logging.debug(f"{type(self).__name__} evicted down to {self._total} bytes")
+
+
+class MetadataCache(BlobCache):
+    """exiftool results, stored as compressed JSON per file and read variant."""
+
+    FILENAME = "metadata.sqlite"
+    TABLE = "metadata"
+
+    def _encode(self, metadata):
+        return zlib.compress(json.dumps(metadata).encode("utf-8"))
+
+    def _decode(self, data):
+        return json.loads(zlib.decompress(data))
+
+
+class ThumbnailCache(BlobCache):
+    """Encoded preview images, one per file and pixel height."""
+
+    FILENAME = "thumbnails.sqlite"
+    TABLE = "thumbnails"
+
+    def __init__(self, path=None, max_bytes=256 * 1024 * 1024):
+        super().__init__(path, max_bytes)
+
+    def get(self, file_path, px):
+        return super().get(file_path, str(px))
+
+    def put(self, file_path, px, data, st=None):
+        super().put(file_path, str(px), bytes(data), st)
+
+    def contains(self, file_path, px):
+        return super().contains(file_path, str(px))
+
+
+class WeatherCache:
+    """SQLite store of open-meteo hourly series, one row per grid cell, day and kind.
+
+    `kind` tells archive data, which never changes, from forecast data;
+    `get` drops an entry older than the `max_age` it is given.
+    """
+
+    def __init__(self, path=None):
+        self.path, self._conn = _connect(path, "weather.sqlite")
+        self._lock = threading.Lock()
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS weather (
+                lat INTEGER NOT NULL,
+                lon INTEGER NOT NULL,
+                date TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                data BLOB NOT NULL,
+                fetched REAL NOT NULL,
+                PRIMARY KEY (lat, lon, date, kind)
+            )""")
+
+    def get(self, cell, date, kind, max_age=None):
+        """Hourly series stored for `cell` (lat, lon grid indices) on `date`."""
+        key = (*cell, date, kind)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, fetched FROM weather"
+                " WHERE lat = ? AND lon = ? AND date = ? AND kind = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                return None
+            if max_age is not None and time.time() - row[1] > max_age:
+                self._conn.execute(
+                    "DELETE FROM weather WHERE lat = ? AND lon = ? AND date = ? AND kind = ?",
+                    key,
+                )
+                return None
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, cell, date, kind, hourly):
+        data = zlib.compress(json.dumps(hourly).encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO weather VALUES (?, ?, ?, ?, ?, ?)",
+                (*cell, date, kind, data, time.time()),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM weather")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
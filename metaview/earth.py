@@ -10,39 +10,44 @@ from vispy.geometry import create_sphere
 from vispy.visuals.filters import TextureFilter
 
 
+def load_texture():
+    """Download (once) and decode the earth texture, safe to call off the GUI thread."""
+    # use cache to save texture
+    cache_dir = appdirs.user_cache_dir("metaview")
+    os.makedirs(cache_dir, exist_ok=True)
+    texture_path = os.path.join(cache_dir, "earth.jpg")
+    url = "https://www.solarsystemscope.com/textures/download/2k_earth_daymap.jpg"
+
+    # try to download texture
+    if not os.path.exists(texture_path):
+        try:
+            urlretrieve(url, texture_path)
+        except Exception as e:
+            print(f"Could not download earth texture: {e}")
+
+    # load texture (blank if fails)
+    try:
+        return np.flipud(imageio.imread(texture_path))
+    except Exception as e:
+        print(f"Could not load earth texture, using blank: {e}")
+        return np.ones((512, 1024, 3), dtype=np.uint8) * 200
+
+
 class EarthWidget(QtWidgets.QWidget):
-    def __init__(self, lat, lon, parent=None):
+    def __init__(self, lat, lon, texture=None, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Simple Earth")
         self.resize(800, 600)
-        self.init_ui(lat, lon)
+        self.init_ui(lat, lon, texture)
 
-    def init_ui(self, lat, lon):        
+    def init_ui(self, lat, lon, texture=None):
         # create canvas
         self.canvas = scene.SceneCanvas(bgcolor="white")
         view = self.canvas.central_widget.add_view()
         view.camera = "arcball"
         view.camera.distance = 3.0
 
-        # use cache to save texture
-        cache_dir = appdirs.user_cache_dir("metaview")
-        os.makedirs(cache_dir, exist_ok=True)
-        texture_path = os.path.join(cache_dir, "earth.jpg")
-        url = "https://www.solarsystemscope.com/textures/download/2k_earth_daymap.jpg"
-
-        # try to download texture
-        if not os.path.exists(texture_path):
-            try:
-                urlretrieve(url, texture_path)
-            except Exception as e:
-                print(f"Could not download earth texture: {e}")
-
-        # load texture (blank if fails)
-        try:
-            earth_texture = np.flipud(imageio.imread(texture_path))
-        except Exception as e:
-            print(f"Could not load earth texture, using blank: {e}")
-            earth_texture = np.ones((512, 1024, 3), dtype=np.uint8) * 200
+        earth_texture = texture if texture is not None else load_texture()
 
         # create earth
         sphere = create_sphere(rows=128, cols=128, radius=1.0)
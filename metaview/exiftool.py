@@ -1,30 +1,667 @@
+import atexit
+import base64
 import json
+import logging
 import os
+import queue
+import re
+import sqlite3
 import subprocess
+import threading
+import time
+from concurrent.futures import Future
 
+from . import cache, extra_data
 
-def get_metadata(file_path):
-    result = subprocess.run(
-        ["exiftool", "-j", "-b", file_path], capture_output=True, text=True
-    )
-    metadata = json.loads(result.stdout)
+
+class ExifToolError(RuntimeError):
+    pass
+
+
+class ExifToolProcess:
+    """A long-lived `exiftool -stay_open True -@ -` session.
+
+    Arguments are sent through stdin and every request is framed with
+    `-execute<N>`, so the output can be read back up to `{ready<N>}`.
+    """
+
+    def __init__(self, executable="exiftool"):
+        self.executable = executable
+        self._process = None
+        self._stderr = None
+        self._counter = 0
+        self.last_stderr = ""
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        self._process = subprocess.Popen(
+            [self.executable, "-stay_open", "True", "-@", "-"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            bufsize=1,
+        )
+        # drain stderr on a thread so a chatty batch can't fill the pipe and block
+        self._stderr = queue.Queue()
+        threading.Thread(
+            target=_pump_lines,
+            args=(self._process.stderr, self._stderr),
+            daemon=True,
+        ).start()
+        logging.debug(f"Started exiftool (pid {self._process.pid})")
+
+    def execute(self, *args):
+        """Run one request and return its (stdout, stderr)."""
+        with self._lock:
+            try:
+                if not self.running:
+                    self.start()
+                return self._execute(args)
+            except (OSError, ValueError, ExifToolError) as e:
+                # the process died (or never came up), restart and retry once
+                logging.warning(f"exiftool crashed, restarting: {e}")
+                self._kill()
+                self.start()
+                return self._execute(args)
+
+    def _execute(self, args):
+        marker = self._send(args)
+        stdout = self._read_until(self._process.stdout.readline, marker)
+        stderr = self._read_until(self._stderr.get, marker)
+        return stdout, stderr
+
+    def _send(self, args):
+        self._counter += 1
+        marker = f"{{ready{self._counter}}}"
+        lines = [_encode_arg(str(arg)) for arg in args]
+        lines += ["-echo4", marker, f"-execute{self._counter}"]
+        self._process.stdin.write("\n".join(lines) + "\n")
+        self._process.stdin.flush()
+        return marker
+
+    def stream(self, *args):
+        """Run one request and yield its stdout line by line as it arrives.
+
+        The session stays locked until the generator is exhausted. If the
+        caller stops early the process is killed rather than drained, and
+        the next request starts a fresh one.
+        """
+        with self._lock:
+            if not self.running:
+                self.start()
+            marker = self._send(args)
+            finished = False
+            try:
+                for line in iter(self._process.stdout.readline, ""):
+                    if line.rstrip("\r\n") == marker:
+                        finished = True
+                        break
+                    yield line
+                if not finished:
+                    raise ExifToolError("exiftool exited unexpectedly")
+                self.last_stderr = self._read_until(self._stderr.get, marker)
+            finally:
+                if not finished:
+                    self._kill()
+
+    def _read_until(self, read_line, marker):
+        output = []
+        while True:
+            line = read_line()
+            if not line:
+                raise ExifToolError("exiftool exited unexpectedly")
+            if line.rstrip("\r\n") == marker:
+                return "".join(output)
+            output.append(line)
+
+    def terminate(self, timeout=5):
+        with self._lock:
+            if not self.running:
+                self._process = None
+                return
+            try:
+                self._process.stdin.write("-stay_open\nFalse\n")
+                self._process.stdin.flush()
+                self._process.wait(timeout=timeout)
+            except (OSError, ValueError, subprocess.TimeoutExpired):
+                pass
+            self._kill()
+
+    def abort(self):
+        """Kill the process without waiting for the session lock.
+
+        A request blocked on its output then fails and `execute` restarts
+        the process. Pipes are left to that thread to close.
+        """
+        process = self._process
+        if process is not None and process.poll() is None:
+            process.kill()
+
+    def _kill(self):
+        if self._process is None:
+            return
+        if self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+        self._close_pipes()
+        self._process = None
+
+    def _close_pipes(self):
+        for stream in (self._process.stdin, self._process.stdout, self._process.stderr):
+            try:
+                stream.close()
+            except (OSError, ValueError):
+                pass
+
+
+def _pump_lines(stream, lines):
+    try:
+        for line in iter(stream.readline, ""):
+            lines.put(line)
+    except (OSError, ValueError):
+        pass
+    lines.put("")
+
+
+def _encode_arg(arg):
+    # argfile lines can't contain newlines, exiftool unescapes "#[CSTR]" lines
+    if "\n" in arg or "\r" in arg:
+        escaped = arg.replace("\\", "\\\\").replace("\n", "\\n").replace("\r", "\\r")
+        return "#[CSTR]" + escaped
+    return arg
+
+
+class _PoolWorker:
+    def __init__(self, process):
+        self.process = process
+        self.outstanding = 0
+        # monotonic start time of the job being run, None while idle
+        self.started = None
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, job):
+        self._jobs.put(job)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            future, args, parse, done = job
+            try:
+                if future.set_running_or_notify_cancel():
+                    self.started = time.monotonic()
+                    try:
+                        result = self.process.execute(*args)
+                        future.set_result(parse(*result) if parse else result)
+                    except Exception as e:
+                        future.set_exception(e)
+            finally:
+                self.started = None
+                done(self)
+
+    def busy_for(self):
+        started = self.started
+        return 0 if started is None else time.monotonic() - started
+
+    def stop(self, cancel=False):
+        """Let the thread exit after the queued jobs, or with `cancel` the running one."""
+        if cancel:
+            with self._jobs.mutex:
+                jobs = list(self._jobs.queue)
+            for job in jobs:
+                if job is not None:
+                    job[0].cancel()
+        self._jobs.put(None)
+
+    def join(self, timeout=None):
+        """Wait for the thread to exit, then shut exiftool down.
+
+        With a `timeout`, a job still running after it gets its process
+        killed, so a wedged exiftool can't hold up quitting.
+        """
+        if timeout is None:
+            self._thread.join()
+        else:
+            # execute() restarts a killed process and retries once
+            for _ in range(2):
+                self._thread.join(timeout)
+                if not self._thread.is_alive():
+                    break
+                logging.warning("exiftool worker did not stop, killing its process")
+                self.process.abort()
+            self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.warning("exiftool worker still busy, leaving it behind")
+            return
+        self.process.terminate()
+
+
+class ExifToolPool:
+    """N persistent exiftool sessions, each fed by its own job queue.
+
+    Jobs go to the worker with the fewest outstanding jobs and come back
+    as `concurrent.futures.Future` objects.
+    """
+
+    def __init__(self, size=None, executable="exiftool"):
+        self.size = max(1, size or POOL_SIZE)
+        self._lock = threading.Lock()
+        self._workers = [
+            _PoolWorker(ExifToolProcess(executable)) for _ in range(self.size)
+        ]
+
+    def submit(self, *args, parse=None):
+        """Queue one exiftool request, `parse(stdout, stderr)` shapes the result."""
+        future = Future()
+        with self._lock:
+            if not self._workers:
+                raise ExifToolError("exiftool pool is shut down")
+            worker = min(self._workers, key=lambda w: w.outstanding)
+            worker.outstanding += 1
+        worker.put((future, args, parse, self._job_done))
+        return future
+
+    def _job_done(self, worker):
+        with self._lock:
+            worker.outstanding -= 1
+
+    def outstanding(self):
+        with self._lock:
+            return [worker.outstanding for worker in self._workers]
+
+    def check_health(self, timeout=10, job_timeout=120):
+        """Check every worker, kill the exiftool process of any that hangs.
+
+        Idle workers are pinged with `-ver` and must answer within `timeout`.
+        Busy ones aren't pinged, since the ping would only queue behind their
+        work; they count as hung once the current job has run for longer than
+        `job_timeout`. Killing the process makes the blocked read fail and the
+        worker restarts it for the job.
+        """
+        with self._lock:
+            workers = list(self._workers)
+            idle = [worker for worker in workers if worker.outstanding == 0]
+            for worker in idle:
+                worker.outstanding += 1
+        pings = {}
+        for worker in idle:
+            future = Future()
+            worker.put((future, ("-ver",), None, self._job_done))
+            pings[worker] = future
+
+        deadline = time.monotonic() + timeout
+        healthy = []
+        for worker in workers:
+            if worker in pings:
+                try:
+                    stdout, _ = pings[worker].result(
+                        timeout=max(0, deadline - time.monotonic())
+                    )
+                    ok = bool(stdout.strip())
+                except Exception as e:
+                    logging.warning(f"exiftool worker failed health check: {e}")
+                    ok = False
+            else:
+                ok = worker.busy_for() <= job_timeout
+                if not ok:
+                    logging.warning("exiftool worker is stuck on a job")
+            if not ok:
+                worker.process.abort()
+            healthy.append(ok)
+        return healthy
+
+    def shutdown(self, cancel_futures=False, timeout=None):
+        """Stop every worker, cancelling queued jobs if `cancel_futures`.
+
+        `timeout` bounds the wait for each worker, see _PoolWorker.join.
+        """
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.stop(cancel_futures)
+        for worker in workers:
+            worker.join(timeout)
+
+
+POOL_SIZE = os.cpu_count() or 1
+# seconds quitting waits for a running exiftool job before killing it
+STOP_TIMEOUT = 5
+# files per exiftool request in batch reads
+CHUNK_SIZE = 500
+
+# read profiles: every tag, or only what MetaView sorts into categories
+PROFILE_FULL = "full"
+PROFILE_CATEGORIZED = "categorized"
+
+CATEGORIZED_TAGS = list(
+    dict.fromkeys(tag for tags in extra_data.categories_dict.values() for tag in tags)
+) + ["GPS:All", "Time:All"]
+
+# reuse results for files that haven't changed since they were last read
+CACHE_ENABLED = True
+
+_process = None
+_process_lock = threading.Lock()
+_pool = None
+_cache = None
+# separate from _process_lock, pool jobs reach the cache while it is held
+_cache_lock = threading.Lock()
+
+
+def get_process():
+    global _process
+    with _process_lock:
+        if _process is None:
+            _process = ExifToolProcess()
+        return _process
+
+
+def execute(*args):
+    return get_process().execute(*args)
+
+
+def get_pool(size=None):
+    """Return the shared worker pool, resizing it if `size` differs."""
+    global _pool
+    old = None
+    with _process_lock:
+        if _pool is not None and size and _pool.size != size:
+            old, _pool = _pool, None
+        if _pool is None:
+            _pool = ExifToolPool(size)
+        pool = _pool
+    # let the old workers finish their jobs without blocking other callers
+    if old is not None:
+        old.shutdown()
+    return pool
+
+
+def set_pool_size(size):
+    global POOL_SIZE
+    POOL_SIZE = max(1, int(size))
+    return get_pool(POOL_SIZE)
+
+
+def submit(*args, parse=None):
+    return get_pool().submit(*args, parse=parse)
+
+
+def get_cache():
+    global _cache, CACHE_ENABLED
+    if not CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = cache.MetadataCache()
+            except (OSError, sqlite3.Error) as e:
+                logging.warning(f"Metadata cache unavailable: {e}")
+                CACHE_ENABLED = False
+        return _cache
+
+
+def _cache_variant(binary, profile):
+    return f"{profile}+binary" if binary else profile
+
+
+def _cached(file_path, binary, profile):
+    metadata_cache = get_cache()
+    # binary reads are rare and big, they'd only push useful entries out
+    if metadata_cache is None or binary:
+        return None
+    metadata = metadata_cache.get(file_path, _cache_variant(binary, profile))
+    if metadata is not None and "SourceFile" in metadata:
+        metadata["SourceFile"] = file_path
+    return metadata
+
+
+def _store(file_path, binary, profile, metadata, st):
+    metadata_cache = get_cache()
+    if metadata_cache is None or binary or st is None:
+        return
+    if metadata and "Error" not in metadata:
+        metadata_cache.put(file_path, _cache_variant(binary, profile), metadata, st)
+
+
+def _invalidate(file_path):
+    metadata_cache = get_cache()
+    if metadata_cache is not None:
+        metadata_cache.invalidate(file_path)
+
+
+def _stat(file_path):
+    try:
+        return os.stat(file_path)
+    except OSError:
+        return None
+
+
+def shutdown():
+    global _process, _pool
+    with _process_lock:
+        process, _process = _process, None
+        pool, _pool = _pool, None
+    if process is not None:
+        process.terminate()
+    if pool is not None:
+        pool.shutdown(cancel_futures=True, timeout=STOP_TIMEOUT)
+
+
+atexit.register(shutdown)
+
+
+def _read_args(binary=False, profile=PROFILE_FULL):
+    # without -b exiftool leaves "(Binary data N bytes, ...)" placeholders
+    args = ["-j", "-b"] if binary else ["-j"]
+    if profile == PROFILE_CATEGORIZED:
+        args += [f"-{tag}" for tag in CATEGORIZED_TAGS]
+    elif profile != PROFILE_FULL:
+        raise ValueError(f"Unknown read profile: {profile}")
+    return args
+
+
+def binary_size(value):
+    """Size in bytes of a binary placeholder value, None for anything else."""
+    if isinstance(value, str):
+        match = re.match(r"\(Binary data (\d+) bytes", value)
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def get_binary_tag(file_path, tag):
+    """Fetch the raw bytes of a single (binary) tag, None if it isn't there."""
+    stdout, _ = execute("-j", "-b", f"-{tag}", file_path)
+    metadata = _parse_metadata(stdout)
+    value = metadata.get(tag.split(":")[-1])
+    if value is None:
+        return None
+    if isinstance(value, str) and value.startswith("base64:"):
+        return base64.b64decode(value[len("base64:") :])
+    return str(value).encode("utf-8")
+
+
+def iter_json_objects(lines):
+    """Yield the elements of exiftool's `-j` array as soon as each one is complete.
+
+    exiftool prints every file as its own block closed by a `}` in the first
+    column (nested structures are indented), so only one file's text is held
+    in memory at a time.
+    """
+    block = []
+    for line in lines:
+        block.append(line)
+        if line.startswith("}"):
+            text = "".join(block).strip().lstrip("[").rstrip("]").rstrip(",")
+            block = []
+            yield json.loads(text)
+
+
+def iter_metadata(file_paths, chunk_size=None, binary=False, profile=PROFILE_FULL):
+    """Stream per-file metadata dicts for many files.
+
+    The stream runs on its own exiftool session, which stays busy for as
+    long as the caller takes, so it doesn't hold up reads on the shared one.
+    """
+    file_paths = list(file_paths)
+    chunk_size = chunk_size or CHUNK_SIZE
+    process = ExifToolProcess()
+    try:
+        for i in range(0, len(file_paths), chunk_size):
+            chunk = file_paths[i : i + chunk_size]
+            yield from iter_json_objects(
+                process.stream(*_read_args(binary, profile), *chunk)
+            )
+    finally:
+        process.terminate()
+
+
+def _parse_metadata(stdout, stderr=""):
+    metadata = json.loads(stdout) if stdout.strip() else []
     return metadata[0] if metadata else {}
 
 
+def _parse_output(stdout, stderr=""):
+    return stdout.strip()
+
+
+def _write_args(file_path, new_data):
+    command = []
+    for key in new_data:
+        command.append(f"-{key}={new_data[key]}")
+    command.append(file_path)
+    return command
+
+
+def get_metadata(file_path, binary=False, profile=PROFILE_FULL):
+    metadata = _cached(file_path, binary, profile)
+    if metadata is not None:
+        return metadata
+    st = _stat(file_path)
+    stdout, _ = execute(*_read_args(binary, profile), file_path)
+    metadata = _parse_metadata(stdout)
+    _store(file_path, binary, profile, metadata, st)
+    return metadata
+
+
+def get_metadata_async(file_path, binary=False, profile=PROFILE_FULL):
+    metadata = _cached(file_path, binary, profile)
+    if metadata is not None:
+        future = Future()
+        future.set_result(metadata)
+        return future
+    st = _stat(file_path)
+
+    def parse(stdout, stderr=""):
+        metadata = _parse_metadata(stdout)
+        _store(file_path, binary, profile, metadata, st)
+        return metadata
+
+    return submit(*_read_args(binary, profile), file_path, parse=parse)
+
+
+def _parse_batch(stdout, stderr=""):
+    results = {}
+    for entry in json.loads(stdout) if stdout.strip() else []:
+        results[entry.get("SourceFile")] = entry
+    # files exiftool couldn't read at all only show up on stderr
+    for line in stderr.splitlines():
+        match = re.match(r"Error: (.+?) - (.+)$", line.strip())
+        if match:
+            message, path = match.groups()
+            results.setdefault(path, {"SourceFile": path, "Error": message})
+    return results
+
+
+def get_metadata_many(file_paths, chunk_size=None, binary=False, profile=PROFILE_FULL):
+    """Read many files in chunks spread over the worker pool.
+
+    Returns a dict keyed by SourceFile. Files that failed carry an "Error"
+    entry, like exiftool does for unsupported files, instead of failing the
+    whole batch.
+    """
+    results = {}
+    missing = []
+    stats = {}
+    for path in dict.fromkeys(file_paths):
+        metadata = _cached(path, binary, profile)
+        if metadata is not None:
+            results[path] = metadata
+        else:
+            missing.append(path)
+            stats[path] = _stat(path)
+
+    chunk_size = chunk_size or CHUNK_SIZE
+    chunks = [missing[i : i + chunk_size] for i in range(0, len(missing), chunk_size)]
+    futures = [
+        submit(*_read_args(binary, profile), *chunk, parse=_parse_batch)
+        for chunk in chunks
+    ]
+
+    for chunk, future in zip(chunks, futures):
+        try:
+            batch = future.result()
+        except Exception as e:
+            logging.warning(f"exiftool batch failed: {e}")
+            batch = {}
+            error = str(e)
+        else:
+            error = "No metadata returned"
+        for path in chunk:
+            metadata = batch.pop(path, None)
+            if metadata is None:
+                metadata = {"SourceFile": path, "Error": error}
+            else:
+                _store(path, binary, profile, metadata, stats[path])
+            results[path] = metadata
+        # anything left was reported under a path spelling we didn't pass in
+        results.update(batch)
+    return results
+
+
 def write_metadata(file_path, new_data):
     if len(new_data) and os.path.exists(file_path):
-        command = ["exiftool"]
-        for key in new_data:
-            command.append(f"-{key}={new_data[key]}")
-        command.append(file_path)
-        result = subprocess.run(command, capture_output=True, text=True)
-        return result.stdout.strip()
+        _invalidate(file_path)
+        stdout, _ = execute(*_write_args(file_path, new_data))
+        return stdout.strip()
     else:
         return "Nothing to write."
 
 
+def copy_tags(source_path, file_path, tags):
+    """Copy `tags` from `source_path` into `file_path`, binary data included."""
+    tags = list(tags)
+    if tags and os.path.exists(source_path) and os.path.exists(file_path):
+        _invalidate(file_path)
+        stdout, _ = execute(
+            "-tagsFromFile", source_path, *[f"-{tag}" for tag in tags], file_path
+        )
+        return stdout.strip()
+    else:
+        return "Nothing to copy."
+
+
+def write_metadata_async(file_path, new_data):
+    if len(new_data) and os.path.exists(file_path):
+        _invalidate(file_path)
+        return submit(*_write_args(file_path, new_data), parse=_parse_output)
+    future = Future()
+    future.set_result("Nothing to write.")
+    return future
+
+
 def delete_metadata(file_path, all=True):
     if os.path.exists(file_path) and all:
-        command = ["exiftool", "-All=", file_path]
-        result = subprocess.run(command, capture_output=True, text=True)
-        return result.stdout.strip()
+        _invalidate(file_path)
+        stdout, _ = execute("-All=", file_path)
+        return stdout.strip()
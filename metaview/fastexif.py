@@ -0,0 +1,1107 @@
+import logging
+import math
+import mmap
+import os
+import re
+import stat
+import struct
+import zlib
+from datetime import datetime
+
+from . import exiftool
+
+
+class Unsupported(Exception):
+    """Raised when a file holds something only exiftool knows how to read."""
+
+
+# TIFF field type -> (struct code, size in bytes)
+TIFF_TYPES = {
+    1: ("B", 1),  # BYTE
+    2: ("s", 1),  # ASCII
+    3: ("H", 2),  # SHORT
+    4: ("I", 4),  # LONG
+    5: ("II", 8),  # RATIONAL
+    6: ("b", 1),  # SBYTE
+    7: ("s", 1),  # UNDEFINED
+    8: ("h", 2),  # SSHORT
+    9: ("i", 4),  # SLONG
+    10: ("ii", 8),  # SRATIONAL
+    11: ("f", 4),  # FLOAT
+    12: ("d", 8),  # DOUBLE
+}
+
+BINARY_PLACEHOLDER = "(Binary data {} bytes, use -b option to extract)"
+
+# exiftool prints these values as JSON numbers, everything else as strings
+JSON_NUMBER = re.compile(r"^-?(\d|[1-9]\d{1,14})(\.\d{1,16})?(e[-+]?\d{1,3})?$", re.I)
+
+
+def _number(value):
+    # exiftool stringifies numbers like perl, with 15 significant digits
+    if isinstance(value, tuple):
+        num, den = value
+        if den == 0:
+            return "inf" if num else "undef"
+        value = num / den
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e15:
+            return int(value)
+        return float("%.15g" % value)
+    return value
+
+
+def _text(raw):
+    raw = bytes(raw).split(b"\0", 1)[0]
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode("latin-1")
+
+
+def _first(values):
+    return values[0] if isinstance(values, list) else values
+
+
+def _joined(values):
+    if isinstance(values, list):
+        values = [_number(v) for v in values]
+        return values[0] if len(values) == 1 else " ".join(str(v) for v in values)
+    return values
+
+
+def _lookup(table):
+    def convert(values):
+        value = _first(values)
+        return table.get(value, f"Unknown ({value})")
+
+    return convert
+
+
+def _version(values):
+    return _text(values)
+
+
+def _exposure_time(value):
+    if not isinstance(value, (int, float)):
+        return value
+    if 0 < value < 0.25001:
+        return "1/%d" % int(0.5 + 1 / value)
+    text = "%.1f" % value
+    return text[:-2] if text.endswith(".0") else text
+
+
+def _f_number(value):
+    if isinstance(value, (int, float)) and value > 0:
+        return ("%.2f" if value < 1 else "%.1f") % value
+    return value
+
+
+def _fraction(value):
+    if not isinstance(value, (int, float)):
+        return value
+    value *= 1.00001
+    if not value:
+        return 0
+    if int(value) / value > 0.999:
+        return "%+d" % int(value)
+    if int(value * 2) / (value * 2) > 0.999:
+        return "%+d/2" % int(value * 2)
+    if int(value * 3) / (value * 3) > 0.999:
+        return "%+d/3" % int(value * 3)
+    return "%+.3g" % value
+
+
+def _apex_aperture(values):
+    value = _number(_first(values))
+    if not isinstance(value, (int, float)):
+        return value
+    return _f_number(2 ** (value / 2))
+
+
+def _apex_shutter(values):
+    value = _number(_first(values))
+    if not isinstance(value, (int, float)):
+        return value
+    return _exposure_time(2 ** -value if abs(value) < 100 else 0)
+
+
+def _with_unit(unit):
+    def convert(values):
+        value = _number(_first(values))
+        if value in ("inf", "undef"):
+            return value
+        return f"{value} {unit}"
+
+    return convert
+
+
+def _focal_length(values):
+    value = _number(_first(values))
+    if isinstance(value, (int, float)):
+        return "%.1f mm" % value
+    return value
+
+
+def _charset_text(raw):
+    # 8 byte character code prefix, then the text
+    raw = bytes(raw)
+    code, text = raw[:8], raw[8:]
+    if code.startswith(b"UNICODE"):
+        raise Unsupported("UCS-2 comment")
+    if code.startswith(b"JIS"):
+        raise Unsupported("JIS comment")
+    return _text(text.rstrip(b"\0 ")).rstrip(" ")
+
+
+def _components(raw):
+    names = {0: "-", 1: "Y", 2: "Cb", 3: "Cr", 4: "R", 5: "G", 6: "B"}
+    return ", ".join(names.get(b, str(b)) for b in bytes(raw))
+
+
+def _lens_info(values):
+    values = [_number(v) for v in values]
+    if len(values) != 4:
+        return _joined(values)
+    low, high, f_low, f_high = [("?" if v in ("inf", "undef") else v) for v in values]
+    text = str(low) if low == high else f"{low}-{high}"
+    text += "mm f/" + (str(f_low) if f_low == f_high else f"{f_low}-{f_high}")
+    return text
+
+
+def _gps_version(raw):
+    return ".".join(str(b) for b in raw)
+
+
+def _dms_value(values):
+    degrees = 0.0
+    for value, scale in zip(values, (1, 60, 3600)):
+        value = _number(value)
+        if not isinstance(value, (int, float)):
+            raise Unsupported("GPS coordinate")
+        degrees += value / scale
+    return degrees
+
+
+def _to_dms(degrees, ref=None):
+    if ref and degrees < 0:
+        degrees = -degrees
+        ref = {"N": "S", "E": "W"}.get(ref, ref)
+    whole = int(degrees)
+    minutes = (degrees - whole) * 60
+    seconds = (minutes - int(minutes)) * 60
+    minutes = int(minutes)
+    if "%.2f" % seconds == "60.00":
+        seconds = 0
+        minutes += 1
+        if minutes == 60:
+            minutes = 0
+            whole += 1
+    text = "%d deg %d' %.2f\"" % (whole, minutes, seconds)
+    return f"{text} {ref}" if ref else text
+
+
+def _time_stamp(values):
+    hours, minutes, seconds = [_number(v) for v in values]
+    if isinstance(seconds, (int, float)) and float(seconds).is_integer():
+        return "%02d:%02d:%02d" % (hours, minutes, seconds)
+    return "%02d:%02d:%s" % (hours, minutes, ("%09.6f" % seconds).rstrip("0"))
+
+
+ORIENTATION = {
+    1: "Horizontal (normal)",
+    2: "Mirror horizontal",
+    3: "Rotate 180",
+    4: "Mirror vertical",
+    5: "Mirror horizontal and rotate 270 CW",
+    6: "Rotate 90 CW",
+    7: "Mirror horizontal and rotate 90 CW",
+    8: "Rotate 270 CW",
+}
+
+RESOLUTION_UNIT = {1: "None", 2: "inches", 3: "cm"}
+
+FLASH = {
+    0x00: "No Flash",
+    0x01: "Fired",
+    0x05: "Fired, Return not detected",
+    0x07: "Fired, Return detected",
+    0x08: "On, Did not fire",
+    0x09: "On, Fired",
+    0x0D: "On, Return not detected",
+    0x0F: "On, Return detected",
+    0x10: "Off, Did not fire",
+    0x14: "Off, Did not fire, Return not detected",
+    0x18: "Auto, Did not fire",
+    0x19: "Auto, Fired",
+    0x1D: "Auto, Fired, Return not detected",
+    0x1F: "Auto, Fired, Return detected",
+    0x20: "No flash function",
+    0x30: "Off, No flash function",
+    0x41: "Fired, Red-eye reduction",
+    0x45: "Fired, Red-eye reduction, Return not detected",
+    0x47: "Fired, Red-eye reduction, Return detected",
+    0x49: "On, Red-eye reduction",
+    0x4D: "On, Red-eye reduction, Return not detected",
+    0x4F: "On, Red-eye reduction, Return detected",
+    0x50: "Off, Red-eye reduction",
+    0x58: "Auto, Did not fire, Red-eye reduction",
+    0x59: "Auto, Fired, Red-eye reduction",
+    0x5D: "Auto, Fired, Red-eye reduction, Return not detected",
+    0x5F: "Auto, Fired, Red-eye reduction, Return detected",
+}
+
+LIGHT_SOURCE = {
+    0: "Unknown",
+    1: "Daylight",
+    2: "Fluorescent",
+    3: "Tungsten (Incandescent)",
+    4: "Flash",
+    9: "Fine Weather",
+    10: "Cloudy",
+    11: "Shade",
+    12: "Daylight Fluorescent",
+    13: "Day White Fluorescent",
+    14: "Cool White Fluorescent",
+    15: "White Fluorescent",
+    16: "Warm White Fluorescent",
+    17: "Standard Light A",
+    18: "Standard Light B",
+    19: "Standard Light C",
+    20: "D55",
+    21: "D65",
+    22: "D75",
+    23: "D50",
+    24: "ISO Studio Tungsten",
+    255: "Other",
+}
+
+NORMAL_LOW_HIGH = {0: "Normal", 1: "Low", 2: "High"}
+
+# tag id -> (exiftool name, conversion); conversion None means plain value(s)
+IFD0_TAGS = {
+    0x0100: ("ImageWidth", None),
+    0x0101: ("ImageHeight", None),
+    0x0102: ("BitsPerSample", None),
+    0x0103: (
+        "Compression",
+        _lookup({1: "Uncompressed", 6: "JPEG (old-style)", 7: "JPEG"}),
+    ),
+    0x0106: (
+        "PhotometricInterpretation",
+        _lookup({0: "WhiteIsZero", 1: "BlackIsZero", 2: "RGB", 6: "YCbCr"}),
+    ),
+    0x010E: ("ImageDescription", None),
+    0x010F: ("Make", None),
+    0x0110: ("Model", None),
+    0x0112: ("Orientation", _lookup(ORIENTATION)),
+    0x0115: ("SamplesPerPixel", None),
+    0x011A: ("XResolution", None),
+    0x011B: ("YResolution", None),
+    0x011C: ("PlanarConfiguration", _lookup({1: "Chunky", 2: "Planar"})),
+    0x0128: ("ResolutionUnit", _lookup(RESOLUTION_UNIT)),
+    0x0131: ("Software", None),
+    0x0132: ("ModifyDate", None),
+    0x013B: ("Artist", None),
+    0x013C: ("HostComputer", None),
+    0x013E: ("WhitePoint", None),
+    0x013F: ("PrimaryChromaticities", None),
+    0x0201: ("ThumbnailOffset", None),
+    0x0202: ("ThumbnailLength", None),
+    0x0211: ("YCbCrCoefficients", None),
+    0x0213: ("YCbCrPositioning", _lookup({1: "Centered", 2: "Co-sited"})),
+    0x0214: ("ReferenceBlackWhite", None),
+    0x8298: ("Copyright", None),
+}
+
+EXIF_TAGS = {
+    0x829A: ("ExposureTime", lambda v: _exposure_time(_number(_first(v)))),
+    0x829D: ("FNumber", lambda v: _f_number(_number(_first(v)))),
+    0x8822: (
+        "ExposureProgram",
+        _lookup(
+            {
+                0: "Not Defined",
+                1: "Manual",
+                2: "Program AE",
+                3: "Aperture-priority AE",
+                4: "Shutter speed priority AE",
+                5: "Creative (Slow speed)",
+                6: "Action (High speed)",
+                7: "Portrait",
+                8: "Landscape",
+                9: "Bulb",
+            }
+        ),
+    ),
+    0x8827: ("ISO", None),
+    0x8830: (
+        "SensitivityType",
+        _lookup(
+            {
+                0: "Unknown",
+                1: "Standard Output Sensitivity",
+                2: "Recommended Exposure Index",
+                3: "ISO Speed",
+                4: "Standard Output Sensitivity and Recommended Exposure Index",
+                5: "Standard Output Sensitivity and ISO Speed",
+                6: "Recommended Exposure Index and ISO Speed",
+                7: "Standard Output Sensitivity, Recommended Exposure Index and ISO Speed",
+            }
+        ),
+    ),
+    0x8831: ("StandardOutputSensitivity", None),
+    0x8832: ("RecommendedExposureIndex", None),
+    0x9000: ("ExifVersion", _version),
+    0x9003: ("DateTimeOriginal", None),
+    0x9004: ("CreateDate", None),
+    0x9010: ("OffsetTime", None),
+    0x9011: ("OffsetTimeOriginal", None),
+    0x9012: ("OffsetTimeDigitized", None),
+    0x9101: ("ComponentsConfiguration", _components),
+    0x9102: ("CompressedBitsPerPixel", None),
+    0x9201: ("ShutterSpeedValue", _apex_shutter),
+    0x9202: ("ApertureValue", _apex_aperture),
+    0x9203: ("BrightnessValue", None),
+    0x9204: ("ExposureCompensation", lambda v: _fraction(_number(_first(v)))),
+    0x9205: ("MaxApertureValue", _apex_aperture),
+    0x9206: ("SubjectDistance", _with_unit("m")),
+    0x9207: (
+        "MeteringMode",
+        _lookup(
+            {
+                0: "Unknown",
+                1: "Average",
+                2: "Center-weighted average",
+                3: "Spot",
+                4: "Multi-spot",
+                5: "Multi-segment",
+                6: "Partial",
+                255: "Other",
+            }
+        ),
+    ),
+    0x9208: ("LightSource", _lookup(LIGHT_SOURCE)),
+    0x9209: ("Flash", _lookup(FLASH)),
+    0x920A: ("FocalLength", _focal_length),
+    0x9214: ("SubjectArea", None),
+    0x9286: ("UserComment", _charset_text),
+    0x9290: ("SubSecTime", None),
+    0x9291: ("SubSecTimeOriginal", None),
+    0x9292: ("SubSecTimeDigitized", None),
+    0xA000: ("FlashpixVersion", _version),
+    0xA001: (
+        "ColorSpace",
+        _lookup(
+            {
+                1: "sRGB",
+                2: "Adobe RGB",
+                0xFFFD: "Wide Gamut RGB",
+                0xFFFE: "ICC Profile",
+                0xFFFF: "Uncalibrated",
+            }
+        ),
+    ),
+    0xA002: ("ExifImageWidth", None),
+    0xA003: ("ExifImageHeight", None),
+    0xA20E: ("FocalPlaneXResolution", None),
+    0xA20F: ("FocalPlaneYResolution", None),
+    0xA210: (
+        "FocalPlaneResolutionUnit",
+        _lookup({1: "None", 2: "inches", 3: "cm", 4: "mm", 5: "um"}),
+    ),
+    0xA215: ("ExposureIndex", None),
+    0xA217: (
+        "SensingMethod",
+        _lookup(
+            {
+                1: "Not defined",
+                2: "One-chip color area",
+                3: "Two-chip color area",
+                4: "Three-chip color area",
+                5: "Color sequential area",
+                7: "Trilinear",
+                8: "Color sequential linear",
+            }
+        ),
+    ),
+    0xA300: (
+        "FileSource",
+        lambda v: {
+            1: "Film Scanner",
+            2: "Reflection Print Scanner",
+            3: "Digital Camera",
+        }.get(bytes(v)[0] if len(v) else None, "Unknown"),
+    ),
+    0xA301: (
+        "SceneType",
+        lambda v: "Directly photographed" if bytes(v)[:1] == b"\x01" else "Unknown",
+    ),
+    0xA401: ("CustomRendered", _lookup({0: "Normal", 1: "Custom"})),
+    0xA402: ("ExposureMode", _lookup({0: "Auto", 1: "Manual", 2: "Auto bracket"})),
+    0xA403: ("WhiteBalance", _lookup({0: "Auto", 1: "Manual"})),
+    0xA404: ("DigitalZoomRatio", None),
+    0xA405: ("FocalLengthIn35mmFormat", _with_unit("mm")),
+    0xA406: (
+        "SceneCaptureType",
+        _lookup({0: "Standard", 1: "Landscape", 2: "Portrait", 3: "Night", 4: "Other"}),
+    ),
+    0xA407: (
+        "GainControl",
+        _lookup(
+            {
+                0: "None",
+                1: "Low gain up",
+                2: "High gain up",
+                3: "Low gain down",
+                4: "High gain down",
+            }
+        ),
+    ),
+    0xA408: ("Contrast", _lookup(NORMAL_LOW_HIGH)),
+    0xA409: ("Saturation", _lookup(NORMAL_LOW_HIGH)),
+    0xA40A: ("Sharpness", _lookup({0: "Normal", 1: "Soft", 2: "Hard"})),
+    0xA40C: (
+        "SubjectDistanceRange",
+        _lookup({0: "Unknown", 1: "Macro", 2: "Close", 3: "Distant"}),
+    ),
+    0xA420: ("ImageUniqueID", None),
+    0xA430: ("OwnerName", None),
+    0xA431: ("SerialNumber", None),
+    0xA432: ("LensInfo", _lens_info),
+    0xA433: ("LensMake", None),
+    0xA434: ("LensModel", None),
+    0xA435: ("LensSerialNumber", None),
+}
+
+INTEROP_TAGS = {
+    0x0001: (
+        "InteropIndex",
+        lambda v: {
+            "R98": "R98 - DCF basic file (sRGB)",
+            "R03": "R03 - DCF option file (Adobe RGB)",
+            "THM": "THM - DCF thumbnail file",
+        }.get(v, v),
+    ),
+    0x0002: ("InteropVersion", _version),
+}
+
+GPS_TAGS = {
+    0x0000: ("GPSVersionID", _gps_version),
+    0x0001: ("GPSLatitudeRef", _lookup({"N": "North", "S": "South"})),
+    0x0002: ("GPSLatitude", list),
+    0x0003: ("GPSLongitudeRef", _lookup({"E": "East", "W": "West"})),
+    0x0004: ("GPSLongitude", list),
+    0x0005: ("GPSAltitudeRef", _lookup({0: "Above Sea Level", 1: "Below Sea Level"})),
+    0x0006: ("GPSAltitude", None),
+    0x0007: ("GPSTimeStamp", _time_stamp),
+    0x0008: ("GPSSatellites", None),
+    0x0009: (
+        "GPSStatus",
+        _lookup({"A": "Measurement Active", "V": "Measurement Void"}),
+    ),
+    0x000A: (
+        "GPSMeasureMode",
+        _lookup({"2": "2-Dimensional Measurement", "3": "3-Dimensional Measurement"}),
+    ),
+    0x000B: ("GPSDOP", None),
+    0x000C: ("GPSSpeedRef", _lookup({"K": "km/h", "M": "mph", "N": "knots"})),
+    0x000D: ("GPSSpeed", None),
+    0x000E: ("GPSTrackRef", _lookup({"M": "Magnetic North", "T": "True North"})),
+    0x000F: ("GPSTrack", None),
+    0x0010: ("GPSImgDirectionRef", _lookup({"M": "Magnetic North", "T": "True North"})),
+    0x0011: ("GPSImgDirection", None),
+    0x0012: ("GPSMapDatum", None),
+    0x0017: ("GPSDestBearingRef", _lookup({"M": "Magnetic North", "T": "True North"})),
+    0x0018: ("GPSDestBearing", None),
+    0x001B: ("GPSProcessingMethod", _charset_text),
+    0x001D: ("GPSDateStamp", None),
+    0x001E: (
+        "GPSDifferential",
+        _lookup({0: "No Correction", 1: "Differential Corrected"}),
+    ),
+    0x001F: ("GPSHPositioningError", _with_unit("m")),
+}
+
+# sub-IFD pointers, followed but not reported (exiftool doesn't list them either)
+EXIF_POINTER = 0x8769
+GPS_POINTER = 0x8825
+INTEROP_POINTER = 0xA005
+
+
+class _Tiff:
+    def __init__(self, buf, start, end):
+        self.buf = buf
+        self.start = start
+        self.end = end
+        order = bytes(buf[start : start + 2])
+        if order == b"II":
+            self.endian = "<"
+        elif order == b"MM":
+            self.endian = ">"
+        else:
+            raise Unsupported("bad TIFF header")
+        if self.unpack("H", 2)[0] != 42:
+            raise Unsupported("bad TIFF magic")
+        self.first_ifd = self.unpack("I", 4)[0]
+
+    def unpack(self, fmt, offset):
+        size = struct.calcsize(self.endian + fmt)
+        if offset < 0 or self.start + offset + size > self.end:
+            raise Unsupported("offset outside of EXIF block")
+        return struct.unpack_from(self.endian + fmt, self.buf, self.start + offset)
+
+    def entries(self, offset):
+        """Return the (tag, raw entry offset) pairs of an IFD and the next IFD offset."""
+        (count,) = self.unpack("H", offset)
+        entries = [
+            (self.unpack("H", offset + 2 + 12 * i)[0], offset + 2 + 12 * i)
+            for i in range(count)
+        ]
+        return entries, self.unpack("I", offset + 2 + 12 * count)[0]
+
+    def entry_value(self, entry):
+        tag, typ, n = self.unpack("HHI", entry)
+        if typ not in TIFF_TYPES:
+            raise Unsupported(f"TIFF type {typ}")
+        code, size = TIFF_TYPES[typ]
+        value_offset = entry + 8
+        if size * n > 4:
+            (value_offset,) = self.unpack("I", entry + 8)
+        return self.value(typ, n, value_offset)
+
+    def value(self, typ, n, offset):
+        code, size = TIFF_TYPES[typ]
+        if offset + size * n > self.end - self.start:
+            raise Unsupported("value outside of EXIF block")
+        if typ in (2, 7):
+            raw = self.buf[self.start + offset : self.start + offset + n]
+            return _text(raw) if typ == 2 else bytes(raw)
+        values = list(self.unpack(f"{n * len(code)}{code[0]}", offset))
+        if typ in (5, 10):
+            values = list(zip(values[::2], values[1::2]))
+        return values
+
+
+def _walk_ifd(tiff, offset, table, result, strict, pointers=()):
+    """Decode one IFD into `result`, return (next offset, {pointer tag: offset})."""
+    found = {}
+    entries, next_ifd = tiff.entries(offset)
+    for tag, entry in entries:
+        try:
+            if tag in pointers:
+                found[tag] = _first(tiff.entry_value(entry))
+                continue
+            if tag not in table:
+                raise Unsupported(f"tag 0x{tag:04x}")
+            name, convert = table[tag]
+            value = tiff.entry_value(entry)
+            try:
+                value = convert(value) if convert else _joined(value)
+            except (TypeError, ValueError, IndexError, KeyError):
+                raise Unsupported(f"can't convert {name}")
+        except Unsupported:
+            if strict:
+                raise
+            continue
+        result.setdefault(name, value)
+    return next_ifd, found
+
+
+def _read_exif(buf, start, end, result, strict=True):
+    tiff = _Tiff(buf, start, end)
+    result["ExifByteOrder"] = (
+        "Little-endian (Intel, II)"
+        if tiff.endian == "<"
+        else "Big-endian (Motorola, MM)"
+    )
+    next_ifd, pointers = _walk_ifd(
+        tiff, tiff.first_ifd, IFD0_TAGS, result, strict, (EXIF_POINTER, GPS_POINTER)
+    )
+
+    gps = {}
+    if EXIF_POINTER in pointers:
+        _, sub = _walk_ifd(
+            tiff, pointers[EXIF_POINTER], EXIF_TAGS, result, strict, (INTEROP_POINTER,)
+        )
+        if INTEROP_POINTER in sub:
+            _walk_ifd(tiff, sub[INTEROP_POINTER], INTEROP_TAGS, result, strict)
+    if GPS_POINTER in pointers:
+        _walk_ifd(tiff, pointers[GPS_POINTER], GPS_TAGS, gps, strict)
+        _add_gps(gps, result)
+
+    thumbnail = None
+    if next_ifd:
+        ifd1 = {}
+        _walk_ifd(tiff, next_ifd, IFD0_TAGS, ifd1, strict)
+        offset, length = ifd1.get("ThumbnailOffset"), ifd1.get("ThumbnailLength")
+        if isinstance(offset, int) and isinstance(length, int) and length:
+            if start + offset + length > end:
+                raise Unsupported("thumbnail outside of EXIF block")
+            thumbnail = (start + offset, length)
+            ifd1["ThumbnailImage"] = BINARY_PLACEHOLDER.format(length)
+        for name, value in ifd1.items():
+            result.setdefault(name, value)
+    return thumbnail
+
+
+def _add_gps(gps, result):
+    for axis, ref_name in (
+        ("GPSLatitude", "GPSLatitudeRef"),
+        ("GPSLongitude", "GPSLongitudeRef"),
+    ):
+        if axis in gps:
+            degrees = _dms_value(gps[axis])
+            ref = None
+            if ref_name in gps:
+                ref = {"North": "N", "South": "S", "East": "E", "West": "W"}.get(
+                    gps[ref_name]
+                )
+                if ref in ("S", "W"):
+                    degrees = -degrees
+                    ref = {"S": "N", "W": "E"}[ref]
+            gps[axis] = _to_dms(degrees, ref)
+    if "GPSAltitude" in gps:
+        altitude = gps["GPSAltitude"]
+        if isinstance(altitude, (int, float)):
+            if gps.get("GPSAltitudeRef") in ("Above Sea Level", "Below Sea Level"):
+                below = gps["GPSAltitudeRef"] == "Below Sea Level"
+                value = _number(int(altitude * 10) / 10)
+                gps["GPSAltitude"] = (
+                    f"{value} m {'Below' if below else 'Above'} Sea Level"
+                )
+            else:
+                gps["GPSAltitude"] = f"{altitude} m"
+    if "GPSDateStamp" in gps and "GPSTimeStamp" in gps:
+        gps["GPSDateTime"] = f"{gps['GPSDateStamp']} {gps['GPSTimeStamp']}Z"
+    if "GPSLatitude" in gps and "GPSLongitude" in gps:
+        gps["GPSPosition"] = f"{gps['GPSLatitude']}, {gps['GPSLongitude']}"
+    for name, value in gps.items():
+        result.setdefault(name, value)
+
+
+def _add_composites(result):
+    if "ImageWidth" in result and "ImageHeight" in result:
+        width, height = result["ImageWidth"], result["ImageHeight"]
+        result["ImageSize"] = f"{width}x{height}"
+        megapixels = width * height / 1000000
+        places = 1 if megapixels >= 1 else (3 if megapixels >= 0.001 else 6)
+        result["Megapixels"] = "%.*f" % (places, megapixels)
+
+    aperture = result.get("FNumber", result.get("ApertureValue"))
+    if aperture is not None:
+        result["Aperture"] = aperture
+    shutter = result.get("ExposureTime", result.get("ShutterSpeedValue"))
+    if shutter is not None:
+        result["ShutterSpeed"] = shutter
+
+    iso = result.get("ISO")
+    if aperture is not None and shutter is not None and iso:
+        try:
+            f_number = float(aperture)
+            exposure = _parse_exposure(shutter)
+            iso = float(str(iso).split()[0])
+            light_value = math.log2(f_number**2 / exposure * 100 / iso)
+            result["LightValue"] = "%.1f" % light_value
+        except (ValueError, ZeroDivisionError):
+            pass
+
+    for date, sub_sec, offset, name in (
+        (
+            "DateTimeOriginal",
+            "SubSecTimeOriginal",
+            "OffsetTimeOriginal",
+            "SubSecDateTimeOriginal",
+        ),
+        (
+            "CreateDate",
+            "SubSecTimeDigitized",
+            "OffsetTimeDigitized",
+            "SubSecCreateDate",
+        ),
+        ("ModifyDate", "SubSecTime", "OffsetTime", "SubSecModifyDate"),
+    ):
+        if date in result and (sub_sec in result or offset in result):
+            value = str(result[date])
+            if sub_sec in result:
+                value += f".{result[sub_sec]}"
+            result[name] = value + str(result.get(offset, ""))
+
+
+def _parse_exposure(value):
+    value = str(value)
+    if "/" in value:
+        num, den = value.split("/", 1)
+        return float(num) / float(den)
+    return float(value)
+
+
+def _file_tags(file_path, st, file_type, extension, mime_type):
+    def file_date(timestamp):
+        text = (
+            datetime.fromtimestamp(timestamp)
+            .astimezone()
+            .strftime("%Y:%m:%d %H:%M:%S%z")
+        )
+        return text[:-2] + ":" + text[-2:]
+
+    return {
+        "SourceFile": file_path,
+        "FileName": os.path.basename(file_path),
+        "Directory": os.path.dirname(file_path) or ".",
+        "FileSize": _file_size(st.st_size),
+        "FileModifyDate": file_date(st.st_mtime),
+        "FileAccessDate": file_date(st.st_atime),
+        "FileInodeChangeDate": file_date(st.st_ctime),
+        "FilePermissions": stat.filemode(st.st_mode),
+        "FileType": file_type,
+        "FileTypeExtension": extension,
+        "MIMEType": mime_type,
+    }
+
+
+def _file_size(size):
+    if size < 2048:
+        return f"{size} bytes"
+    if size < 10240:
+        return "%.1f kB" % (size / 1024)
+    if size < 2097152:
+        return "%.0f kB" % (size / 1024)
+    if size < 10485760:
+        return "%.1f MB" % (size / 1048576)
+    if size < 2147483648:
+        return "%.0f MB" % (size / 1048576)
+    if size < 10737418240:
+        return "%.1f GB" % (size / 1073741824)
+    return "%.0f GB" % (size / 1073741824)
+
+
+def _jsonify(result):
+    # match the types json.loads gives for exiftool's output
+    for key, value in result.items():
+        if isinstance(value, str) and JSON_NUMBER.match(value):
+            result[key] = float(value) if re.search(r"[.eE]", value) else int(value)
+    return result
+
+
+SOF_MARKERS = {
+    0xC0: "Baseline DCT, Huffman coding",
+    0xC1: "Extended sequential DCT, Huffman coding",
+    0xC2: "Progressive DCT, Huffman coding",
+    0xC3: "Lossless, Huffman coding",
+    0xC5: "Sequential DCT, differential Huffman coding",
+    0xC6: "Progressive DCT, differential Huffman coding",
+    0xC7: "Lossless, Differential Huffman coding",
+    0xC9: "Extended sequential DCT, arithmetic coding",
+    0xCA: "Progressive DCT, arithmetic coding",
+    0xCB: "Lossless, arithmetic coding",
+    0xCD: "Sequential DCT, differential arithmetic coding",
+    0xCE: "Progressive DCT, differential arithmetic coding",
+    0xCF: "Lossless, differential arithmetic coding",
+}
+
+SUBSAMPLING = {
+    (1, 1): "YCbCr4:4:4 (1 1)",
+    (1, 2): "YCbCr4:4:0 (1 2)",
+    (2, 1): "YCbCr4:2:2 (2 1)",
+    (2, 2): "YCbCr4:2:0 (2 2)",
+    (4, 1): "YCbCr4:1:1 (4 1)",
+    (4, 2): "YCbCr4:1:0 (4 2)",
+}
+
+
+def _read_sof(buf, pos, marker, result):
+    bits, height, width, components = struct.unpack_from(">BHHB", buf, pos)
+    result["ImageWidth"] = width
+    result["ImageHeight"] = height
+    result["EncodingProcess"] = SOF_MARKERS[marker]
+    result["BitsPerSample"] = bits
+    result["ColorComponents"] = components
+    if components == 3:
+        sampling = buf[pos + 7]
+        key = (sampling >> 4, sampling & 0x0F)
+        if key in SUBSAMPLING:
+            result["YCbCrSubSampling"] = SUBSAMPLING[key]
+
+
+def _read_jfif(buf, start, end, result):
+    major, minor, units, x_density, y_density = struct.unpack_from(
+        ">BBBHH", buf, start + 5
+    )
+    result["JFIFVersion"] = "%d.%.2d" % (major, minor)
+    result["ResolutionUnit"] = {0: "None", 1: "inches", 2: "cm"}.get(
+        units, f"Unknown ({units})"
+    )
+    result["XResolution"] = x_density
+    result["YResolution"] = y_density
+
+
+def read_jpeg(file_path, strict=True):
+    """Decode a JPEG's EXIF, JFIF and frame header without running exiftool.
+
+    Returns (metadata, thumbnail) where thumbnail is the (offset, length)
+    of the embedded IFD1 JPEG, or None. With `strict` any segment or tag
+    exiftool would report but this reader doesn't know raises Unsupported,
+    otherwise those are skipped.
+    """
+    with open(file_path, "rb") as f:
+        st = os.fstat(f.fileno())
+        if st.st_size < 4:
+            raise Unsupported("file too small")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return _read_jpeg(file_path, st, buf, strict)
+
+
+def _read_jpeg(file_path, st, buf, strict):
+    if buf[:2] != b"\xff\xd8":
+        raise Unsupported("not a JPEG")
+    result = {}
+    thumbnail = None
+    pos = 2
+    size = len(buf)
+    while pos + 4 <= size:
+        if buf[pos] != 0xFF:
+            raise Unsupported("lost JPEG marker sync")
+        marker = buf[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0xDA or marker == 0xD9:
+            break
+        (length,) = struct.unpack_from(">H", buf, pos + 2)
+        start, end = pos + 4, pos + 2 + length
+        if length < 2 or end > size:
+            raise Unsupported("truncated JPEG segment")
+        pos = end
+
+        try:
+            if marker in SOF_MARKERS:
+                _read_sof(buf, start, marker, result)
+            elif marker == 0xE0 and buf[start : start + 5] == b"JFIF\0":
+                _read_jfif(buf, start, end, result)
+            elif marker == 0xE1 and buf[start : start + 6] == b"Exif\0\0":
+                # decode into a fresh dict so EXIF wins over JFIF duplicates
+                exif = {}
+                thumbnail = _read_exif(buf, start + 6, end, exif, strict)
+                result.update(exif)
+            elif marker == 0xFE:
+                result.setdefault("Comment", _text(buf[start:end]))
+            elif 0xE0 <= marker <= 0xEF:
+                raise Unsupported(f"APP{marker - 0xE0} segment")
+        except Unsupported:
+            if strict:
+                raise
+        except struct.error:
+            raise Unsupported("truncated JPEG segment")
+
+    metadata = _file_tags(file_path, st, "JPEG", "jpg", "image/jpeg")
+    metadata.update(result)
+    _add_composites(metadata)
+    return _jsonify(metadata), thumbnail
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+PNG_COLOR_TYPES = {
+    0: "Grayscale",
+    2: "RGB",
+    3: "Palette",
+    4: "Grayscale with Alpha",
+    6: "RGB with Alpha",
+}
+
+# text keywords that aren't tags of their own
+PNG_UNSUPPORTED_TEXT = ("XML:com.adobe.xmp", "Raw profile type")
+
+
+def _png_tag_name(keyword):
+    # exiftool drops anything that can't be in a tag name, "date:create" -> "Datecreate"
+    name = re.sub(r"[^A-Za-z0-9_-]", "", keyword)
+    return name[:1].upper() + name[1:]
+
+
+def _png_text(chunk_type, data, inflate):
+    """Return (keyword, text) of a tEXt/zTXt/iTXt chunk."""
+    keyword, _, rest = bytes(data[:80]).partition(b"\0")
+    body = data[len(keyword) + 1 :]
+    keyword = keyword.decode("latin-1")
+    encoding = "latin-1"
+    compressed = chunk_type == b"zTXt"
+    if chunk_type == b"zTXt":
+        body = body[1:]
+    elif chunk_type == b"iTXt":
+        compressed = body[0] == 1
+        # skip compression method, language tag and translated keyword
+        header = bytes(body[2:])
+        language_end = header.index(b"\0")
+        translated_end = header.index(b"\0", language_end + 1)
+        body = body[2 + translated_end + 1 :]
+        encoding = "utf-8"
+    if compressed:
+        if not inflate:
+            return keyword, f"(Compressed text, {len(body)} bytes)"
+        raw = zlib.decompress(body)
+    else:
+        raw = bytes(body)
+    return keyword, raw.decode(encoding, errors="replace")
+
+
+def _read_png_chunk(chunk_type, data, result, strict, inflate):
+    if chunk_type == b"IHDR":
+        width, height, depth, color, compression, filter_, interlace = (
+            struct.unpack_from(">IIBBBBB", data)
+        )
+        result["ImageWidth"] = width
+        result["ImageHeight"] = height
+        result["BitDepth"] = depth
+        result["ColorType"] = PNG_COLOR_TYPES.get(color, f"Unknown ({color})")
+        result["Compression"] = (
+            "Deflate/Inflate" if compression == 0 else f"Unknown ({compression})"
+        )
+        result["Filter"] = "Adaptive" if filter_ == 0 else f"Unknown ({filter_})"
+        result["Interlace"] = {0: "Noninterlaced", 1: "Adam7 Interlace"}.get(
+            interlace, f"Unknown ({interlace})"
+        )
+    elif chunk_type == b"pHYs":
+        x, y, unit = struct.unpack_from(">IIB", data)
+        result["PixelsPerUnitX"] = x
+        result["PixelsPerUnitY"] = y
+        result["PixelUnits"] = {0: "Unknown", 1: "meters"}.get(
+            unit, f"Unknown ({unit})"
+        )
+    elif chunk_type == b"gAMA":
+        (gamma,) = struct.unpack_from(">I", data)
+        if gamma:
+            result["Gamma"] = _number(round(100000 / gamma, 4))
+    elif chunk_type == b"sRGB":
+        result["SRGBRendering"] = {
+            0: "Perceptual",
+            1: "Relative Colorimetric",
+            2: "Saturation",
+            3: "Absolute Colorimetric",
+        }.get(data[0], f"Unknown ({data[0]})")
+    elif chunk_type == b"tIME":
+        result["ModifyDate"] = "%.4d:%.2d:%.2d %.2d:%.2d:%.2d" % struct.unpack_from(
+            ">HBBBBB", data
+        )
+    elif chunk_type == b"cHRM":
+        names = (
+            "WhitePointX",
+            "WhitePointY",
+            "RedX",
+            "RedY",
+            "GreenX",
+            "GreenY",
+            "BlueX",
+            "BlueY",
+        )
+        for name, value in zip(names, struct.unpack_from(">8I", data)):
+            result[name] = _number(value / 100000)
+    elif chunk_type == b"bKGD":
+        count = len(data) // 2
+        if len(data) == 1:
+            result["BackgroundColor"] = data[0]
+        else:
+            result["BackgroundColor"] = _joined(
+                list(struct.unpack_from(f">{count}H", data))
+            )
+    elif chunk_type in (b"PLTE", b"tRNS"):
+        name = "Palette" if chunk_type == b"PLTE" else "Transparency"
+        result[name] = BINARY_PLACEHOLDER.format(len(data))
+    elif chunk_type == b"eXIf":
+        start = 6 if bytes(data[:6]) == b"Exif\0\0" else 0
+        exif = {}
+        _read_exif(data, start, len(data), exif, strict)
+        result.update(exif)
+    elif chunk_type in (b"tEXt", b"zTXt", b"iTXt"):
+        keyword, text = _png_text(chunk_type, data, inflate)
+        if keyword.startswith(PNG_UNSUPPORTED_TEXT):
+            raise Unsupported(f"PNG text '{keyword}'")
+        result.setdefault(_png_tag_name(keyword), text)
+    else:
+        raise Unsupported(f"PNG chunk {chunk_type.decode('latin-1')}")
+
+
+def read_png(file_path, strict=True, inflate=False):
+    """Decode a PNG's header and metadata chunks without running exiftool.
+
+    Chunks are walked as memoryview slices of an mmap and the walk stops at
+    the first IDAT. Compressed text is only inflated when `inflate` is set,
+    otherwise it is reported as a size placeholder. `strict` works as in
+    read_jpeg.
+    """
+    with open(file_path, "rb") as f:
+        st = os.fstat(f.fileno())
+        if st.st_size < len(PNG_SIGNATURE) + 12:
+            raise Unsupported("file too small")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            with memoryview(buf) as view:
+                return _read_png(file_path, st, view, strict, inflate)
+
+
+def _read_png(file_path, st, view, strict, inflate):
+    if bytes(view[:8]) != PNG_SIGNATURE:
+        raise Unsupported("not a PNG")
+    result = {}
+    pos = 8
+    size = len(view)
+    while pos + 8 <= size:
+        length, chunk_type = struct.unpack_from(">I4s", view, pos)
+        start, end = pos + 8, pos + 8 + length
+        if end + 4 > size:
+            raise Unsupported("truncated PNG chunk")
+        pos = end + 4
+        if chunk_type in (b"IDAT", b"IEND"):
+            break
+        data = view[start:end]
+        try:
+            _read_png_chunk(chunk_type, data, result, strict, inflate)
+        except Unsupported:
+            if strict:
+                raise
+        except (struct.error, IndexError, ValueError, zlib.error):
+            if strict:
+                raise Unsupported(f"bad PNG chunk {chunk_type.decode('latin-1')}")
+        finally:
+            data.release()
+
+    metadata = _file_tags(file_path, st, "PNG", "png", "image/png")
+    metadata.update(result)
+    _add_composites(metadata)
+    return _jsonify(metadata)
+
+
+def _read(file_path, strict):
+    """Metadata decoded in-process, None if exiftool has to read the file."""
+    try:
+        if file_path.lower().endswith((".jpg", ".jpeg")):
+            metadata, _ = read_jpeg(file_path, strict)
+            return metadata
+        if file_path.lower().endswith(".png"):
+            return read_png(file_path, strict, inflate=True)
+    except (Unsupported, OSError, ValueError) as e:
+        logging.debug(f"Fast path can't read {file_path}: {e}")
+    return None
+
+
+def get_metadata(file_path, strict=True):
+    """Like exiftool.get_metadata, but decoded in-process when possible."""
+    metadata = _read(file_path, strict)
+    if metadata is None:
+        metadata = exiftool.get_metadata(file_path)
+    return metadata
+
+
+def get_metadata_many(file_paths, strict=True):
+    """Like exiftool.get_metadata_many, exiftool only reads what the fast path can't."""
+    results = {}
+    missing = []
+    for file_path in file_paths:
+        metadata = _read(file_path, strict)
+        if metadata is None:
+            missing.append(file_path)
+        else:
+            results[file_path] = metadata
+    if missing:
+        results.update(exiftool.get_metadata_many(missing))
+    return results
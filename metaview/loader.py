@@ -0,0 +1,102 @@
+import contextlib
+import logging
+import threading
+
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+
+
+class CancelToken:
+    """Marks the work belonging to one file load.
+
+    Cancelling makes tasks that haven't started yet return without running
+    and runs the callbacks registered with `on_cancel()`, which is how
+    weather.WeatherClient aborts the HTTP requests it has in flight.
+    """
+
+    def __init__(self, generation=0):
+        self.generation = generation
+        self._cancelled = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def wait(self, timeout):
+        """Sleep up to `timeout` seconds, True if cancelled meanwhile."""
+        return self._cancelled.wait(timeout)
+
+    @contextlib.contextmanager
+    def on_cancel(self, callback):
+        """Call `callback` if the token is cancelled before the block ends.
+
+        It is called right away when the token already is cancelled.
+        """
+        with self._lock:
+            cancelled = self.cancelled
+            if not cancelled:
+                self._callbacks.append(callback)
+        if cancelled:
+            callback()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+class TaskSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    # emitted last with the task itself, whether it ran, failed or was cancelled
+    done = pyqtSignal(object)
+
+
+class Task(QRunnable):
+    """Runs `fn(*args)` on a QThreadPool and reports back through signals.
+
+    The signals object is created on the GUI thread, so connected slots run
+    there as well.
+    """
+
+    def __init__(self, fn, *args, token=None):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.token = token
+        self.signals = TaskSignals()
+        # owned by the caller so it can still be tryTake()n from the pool,
+        # which has to keep a reference until `signals.done`
+        self.setAutoDelete(False)
+
+    def run(self):
+        try:
+            self._run()
+        finally:
+            self.signals.done.emit(self)
+
+    def _run(self):
+        if self.token is not None and self.token.cancelled:
+            return
+        try:
+            result = self.fn(*self.args)
+        except Exception as e:
+            if self.token is not None and self.token.cancelled:
+                return
+            logging.exception(
+                f"Background task {getattr(self.fn, '__name__', self.fn)} failed"
+            )
+            self.signals.failed.emit(str(e))
+            return
+        if self.token is not None and self.token.cancelled:
+            return
+        self.signals.finished.emit(result)
@@ -1,7 +1,31 @@
+import atexit
+import csv
+import functools
+import json
+import logging
+import os
+import pickle
 import re
+import threading
+from collections import OrderedDict
 
-import country_converter as coco
+import numpy as np
 import reverse_geocoder as rg
+from scipy.spatial import cKDTree
+
+from .cache import CACHE_DIR
+from .extra_data import country_names
+
+GEOCODER_DIR = os.path.join(CACHE_DIR, "geocoder")
+# coordinates are snapped to this grid (in degrees, about 110 m) for the cache
+GEOCODE_GRID = 0.001
+GEOCODE_CACHE_SIZE = 10000
+# keep cached locations across runs
+GEOCODE_CACHE_PERSIST = True
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+_geocode_cache = None
 
 
 def convert_dms(dms):
@@ -21,11 +45,277 @@ def convert_dms(dms):
     return decimal
 
 
+class Geocoder:
+    """Nearest-city lookup over reverse_geocoder's bundled city list.
+
+    The parsed coordinates and labels are kept in `cache_dir` as .npy files
+    that are memory-mapped on load, next to the pickled KD-tree, and rebuilt
+    whenever reverse_geocoder's CSV changes. Queries run in this process
+    instead of rg's multiprocessing pool.
+    """
+
+    def __init__(self, source=None, cache_dir=GEOCODER_DIR):
+        self.source = source or rg.rel_path(rg.RG_FILE)
+        self.cache_dir = cache_dir
+        try:
+            self._load()
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError) as e:
+            logging.debug(f"Building geocoder cache ({e})")
+            self._build()
+            try:
+                self._save()
+            except OSError as e:
+                logging.warning(f"Could not save geocoder cache: {e}")
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _stamp(self):
+        st = os.stat(self.source)
+        return {
+            "source": os.path.abspath(self.source),
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+        }
+
+    def _load(self):
+        with open(self._path("meta.json"), encoding="utf-8") as f:
+            if json.load(f) != self._stamp():
+                raise ValueError("city list changed")
+        self.coords = np.load(self._path("coords.npy"), mmap_mode="r")
+        self.labels = np.load(self._path("labels.npy"), mmap_mode="r")
+        self.offsets = np.load(self._path("offsets.npy"), mmap_mode="r")
+        with open(self._path("tree.pickle"), "rb") as f:
+            self.tree = pickle.load(f)
+
+    def _build(self):
+        coords, labels = [], []
+        with open(self.source, encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                coords.append((float(row["lat"]), float(row["lon"])))
+                labels.append(
+                    f"{row['name']}\t{row['admin1']}\t{row['cc']}".encode("utf-8")
+                )
+        self.coords = np.array(coords, dtype=float).reshape(-1, 2)
+        # labels are one UTF-8 buffer, row i spans offsets[i]:offsets[i + 1]
+        self.offsets = np.zeros(len(labels) + 1, dtype=np.int64)
+        np.cumsum([len(label) for label in labels], out=self.offsets[1:])
+        self.labels = np.frombuffer(b"".join(labels), dtype=np.uint8)
+        self.tree = cKDTree(self.coords)
+
+    def _save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # meta.json is written last, so a half-written cache is never loaded
+        if os.path.exists(self._path("meta.json")):
+            os.remove(self._path("meta.json"))
+        np.save(self._path("coords.npy"), self.coords)
+        np.save(self._path("labels.npy"), self.labels)
+        np.save(self._path("offsets.npy"), self.offsets)
+        with open(self._path("tree.pickle"), "wb") as f:
+            pickle.dump(self.tree, f, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(self._path("meta.json.tmp"), "w", encoding="utf-8") as f:
+            json.dump(self._stamp(), f)
+        os.replace(self._path("meta.json.tmp"), self._path("meta.json"))
+
+    def label(self, index):
+        """(city, region, country code) of the city at `index`."""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return tuple(bytes(self.labels[start:end]).decode("utf-8").split("\t"))
+
+    def search(self, coords):
+        """Index of the nearest city for each row of an N x 2 (lat, lon) array."""
+        _, indices = self.tree.query(coords, k=1)
+        return np.atleast_1d(indices)
+
+
+def get_geocoder():
+    global _geocoder
+    with _geocoder_lock:
+        if _geocoder is None:
+            _geocoder = Geocoder()
+        return _geocoder
+
+
+def _preload():
+    try:
+        get_geocoder()
+    except Exception:
+        logging.exception("Could not load the geocoder")
+
+
+def preload(background=True):
+    """Load the geocoder ahead of the first lookup, on a daemon thread by default."""
+    if not background:
+        return get_geocoder()
+    thread = threading.Thread(target=_preload, name="geocoder-preload", daemon=True)
+    thread.start()
+    return thread
+
+
+class GeocodeCache:
+    """LRU of (city, region, country) per grid cell, with hit/miss counters.
+
+    Holds at most `max_entries` cells. With a `path` the entries are read
+    from there on creation and written back by `save()`.
+    """
+
+    def __init__(self, grid=GEOCODE_GRID, max_entries=GEOCODE_CACHE_SIZE, path=None):
+        self.grid = grid
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        if path:
+            self._read()
+
+    def key(self, lat, lon):
+        return round(lat / self.grid), round(lon / self.grid)
+
+    def get(self, lat, lon):
+        key = self.key(lat, lon)
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, lat, lon, value):
+        key = self.key(lat, lon)
+        with self._lock:
+            self._entries[key] = tuple(value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate(),
+                "entries": len(self._entries),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+            self._dirty = True
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("grid") != self.grid:
+            return
+        for lat_cell, lon_cell, *value in data.get("entries", [])[-self.max_entries :]:
+            self._entries[(lat_cell, lon_cell)] = tuple(value)
+
+    def save(self):
+        if not self.path or not self._dirty:
+            return
+        with self._lock:
+            data = {
+                "grid": self.grid,
+                "entries": [[*key, *value] for key, value in self._entries.items()],
+            }
+            self._dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            logging.warning(f"Could not save geocode cache: {e}")
+
+
+def get_geocode_cache():
+    global _geocode_cache
+    with _geocoder_lock:
+        if _geocode_cache is None:
+            path = (
+                os.path.join(CACHE_DIR, "geocode.json")
+                if GEOCODE_CACHE_PERSIST
+                else None
+            )
+            _geocode_cache = GeocodeCache(path=path)
+            atexit.register(_geocode_cache.save)
+        return _geocode_cache
+
+
+def get_locations(coords):
+    """Reverse geocode an N x 2 array of (lat, lon).
+
+    Rows whose grid cell is cached skip the KD-tree, the rest go through it
+    in one batched query. Returns (cities, regions, countries), three object
+    arrays of length N.
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    cities = np.empty(len(coords), dtype=object)
+    regions = np.empty(len(coords), dtype=object)
+    countries = np.empty(len(coords), dtype=object)
+
+    geocode_cache = get_geocode_cache()
+    missing = []
+    for row, (lat, lon) in enumerate(coords.tolist()):
+        value = geocode_cache.get(lat, lon)
+        if value is None:
+            missing.append(row)
+        else:
+            cities[row], regions[row], countries[row] = value
+    if not missing:
+        return cities, regions, countries
+
+    found = _search(coords[missing])
+    for row, (lat, lon), value in zip(missing, coords[missing].tolist(), zip(*found)):
+        cities[row], regions[row], countries[row] = value
+        geocode_cache.put(lat, lon, value)
+    return cities, regions, countries
+
+
+def _search(coords):
+    geocoder = get_geocoder()
+    indices, inverse = np.unique(geocoder.search(coords), return_inverse=True)
+    labels = [geocoder.label(index) for index in indices]
+    cities = np.array([city for city, _, _ in labels], dtype=object)[inverse]
+    regions = np.array([region for _, region, _ in labels], dtype=object)[inverse]
+    countries = np.array([country_name(code) for _, _, code in labels], dtype=object)[
+        inverse
+    ]
+    return cities, regions, countries
+
+
+@functools.lru_cache(maxsize=None)
+def _convert_country(code):
+    # only for codes missing from the table, country_converter is slow to import
+    import country_converter as coco
+
+    return coco.convert(code, to="name_short")
+
+
+def country_name(code):
+    """Short country name for an ISO 3166-1 alpha-2 code."""
+    name = country_names.get(code)
+    return name if name is not None else _convert_country(code)
+
+
 def get_location(lat, lon):
-    results = rg.search((lat, lon))
-    if results:
-        info = results[0]
-        return info["name"], info["admin1"], coco.convert(info["cc"], to="name_short")
+    cities, regions, countries = get_locations([(lat, lon)])
+    if len(cities):
+        return cities[0], regions[0], countries[0]
     return None, None, None
 
 
@@ -33,8 +323,5 @@ if __name__ == "__main__":
     latitude = "43 deg 28' 5.68\" N"
     longitude = "11 deg 52' 48.62\" E"
 
-    city, region, country_code = get_location(
-        convert_dms(latitude), convert_dms(longitude)
-    )
-    country_code = coco.convert(country_code, to="name_short")
-    print(f"City: {city}, Region: {region}, Country: {country_code}")
+    city, region, country = get_location(convert_dms(latitude), convert_dms(longitude))
+    print(f"City: {city}, Region: {region}, Country: {country}")
@@ -0,0 +1,230 @@
+import logging
+import os
+import sqlite3
+import threading
+
+from PyQt5.QtCore import QBuffer, QByteArray, QIODevice, QSize, Qt
+from PyQt5.QtGui import QImage, QImageIOHandler, QImageReader, QTransform
+
+from . import cache, exiftool, fastexif
+
+PREVIEW_HEIGHT = 128
+# heights kept in the thumbnail cache, 256 is for HiDPI screens and galleries
+THUMBNAIL_SIZES = (128, 256)
+# keep generated thumbnails across runs
+CACHE_ENABLED = True
+# embedded images exiftool can extract, largest first
+EMBEDDED_TAGS = ("PreviewImage", "ThumbnailImage")
+# a usual 160x120 EXIF thumbnail shown 128 px high is still sharp enough
+MAX_UPSCALE = 1.1
+
+_cache = None
+_cache_lock = threading.Lock()
+
+ORIENTATION = {name: number for number, name in fastexif.ORIENTATION.items()}
+# EXIF orientation -> (mirror horizontally first, then rotate clockwise by)
+TRANSFORMS = {
+    1: (False, 0),
+    2: (True, 0),
+    3: (False, 180),
+    4: (True, 180),
+    5: (True, 270),
+    6: (False, 90),
+    7: (True, 90),
+    8: (False, 270),
+}
+
+
+def orientation_number(value):
+    """EXIF orientation (1-8) from exiftool's number or print-converted name."""
+    if isinstance(value, int):
+        return value if value in TRANSFORMS else 1
+    return ORIENTATION.get(str(value), 1)
+
+
+def apply_orientation(image, orientation):
+    mirror, angle = TRANSFORMS[orientation_number(orientation)]
+    if mirror:
+        image = image.mirrored(True, False)
+    if angle:
+        image = image.transformed(QTransform().rotate(angle))
+    return image
+
+
+def _shown_height(size, swapped):
+    return size.width() if swapped else size.height()
+
+
+def _scaled_size(size, height, swapped):
+    """Size to decode at so the image ends up `height` tall once oriented."""
+    shown_height = _shown_height(size, swapped)
+    if shown_height <= height:
+        return size
+    scale = height / shown_height
+    return QSize(
+        max(1, round(size.width() * scale)), max(1, round(size.height() * scale))
+    )
+
+
+def _read(reader, height, swapped):
+    size = reader.size()
+    if size.isValid():
+        reader.setScaledSize(_scaled_size(size, height, swapped))
+    image = reader.read()
+    if image.isNull():
+        raise ValueError(reader.errorString())
+    return image
+
+
+def _embedded_images(file_path, tags):
+    """Yield the bytes of the file's embedded previews, cheapest first."""
+    done = set()
+    if file_path.lower().endswith((".jpg", ".jpeg")):
+        try:
+            _, thumbnail = fastexif.read_jpeg(file_path, strict=False)
+        except (fastexif.Unsupported, OSError, ValueError) as e:
+            logging.debug(f"No in-process thumbnail for {file_path}: {e}")
+            thumbnail = None
+        if thumbnail:
+            offset, length = thumbnail
+            with open(file_path, "rb") as f:
+                f.seek(offset)
+                data = f.read(length)
+            done.add("ThumbnailImage")
+            yield data
+    for tag in EMBEDDED_TAGS:
+        if tag not in tags or tag in done:
+            continue
+        try:
+            data = exiftool.get_binary_tag(file_path, tag)
+        except (exiftool.ExifToolError, OSError, ValueError) as e:
+            logging.debug(f"Could not extract {tag} from {file_path}: {e}")
+            continue
+        if data:
+            yield data
+
+
+def load_preview(file_path, orientation=None, embedded_tags=(), height=PREVIEW_HEIGHT):
+    """Decode a QImage about `height` pixels high, safe to call off the GUI thread.
+
+    An embedded preview or thumbnail is used when it is big enough, otherwise
+    the image itself is decoded at reduced size (JPEGs scale while decoding).
+    `orientation` is exiftool's Orientation value and is applied in both cases.
+    """
+    swapped = TRANSFORMS[orientation_number(orientation)][1] in (90, 270)
+    for data in _embedded_images(file_path, embedded_tags):
+        buffer = QBuffer()
+        buffer.setData(QByteArray(data))
+        buffer.open(QIODevice.ReadOnly)
+        reader = QImageReader(buffer)
+        reader.setAutoTransform(False)
+        size = reader.size()
+        if not size.isValid() or _shown_height(size, swapped) * MAX_UPSCALE < height:
+            continue
+        try:
+            image = _read(reader, height, swapped)
+        except ValueError as e:
+            logging.debug(f"Could not decode embedded preview of {file_path}: {e}")
+            continue
+        return apply_orientation(image, orientation)
+
+    reader = QImageReader(file_path)
+    reader.setAutoTransform(True)
+    swapped = bool(reader.transformation() & QImageIOHandler.TransformationRotate90)
+    return _read(reader, height, swapped)
+
+
+def get_cache():
+    global _cache, CACHE_ENABLED
+    if not CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = cache.ThumbnailCache()
+            except (OSError, sqlite3.Error) as e:
+                logging.warning(f"Thumbnail cache unavailable: {e}")
+                CACHE_ENABLED = False
+        return _cache
+
+
+def _encode(image):
+    buffer = QBuffer()
+    buffer.open(QIODevice.WriteOnly)
+    image.save(buffer, "PNG" if image.hasAlphaChannel() else "JPEG", 90)
+    return bytes(buffer.data())
+
+
+def _cached(file_path, px):
+    thumbnail_cache = get_cache()
+    if thumbnail_cache is None:
+        return None
+    data = thumbnail_cache.get(file_path, px)
+    if data is None:
+        return None
+    image = QImage.fromData(data)
+    return None if image.isNull() else image
+
+
+def _make_thumbnails(file_path, sizes, orientation, embedded_tags):
+    """Decode once at the largest size, scale down for the rest and cache them all."""
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        st = None
+    image = load_preview(file_path, orientation, embedded_tags, max(sizes))
+    thumbnails = {}
+    for px in sorted(sizes, reverse=True):
+        if image.height() > px:
+            thumbnails[px] = image.scaledToHeight(px, Qt.SmoothTransformation)
+        else:
+            thumbnails[px] = image
+    thumbnail_cache = get_cache()
+    if thumbnail_cache is not None and st is not None:
+        for px, thumbnail in thumbnails.items():
+            thumbnail_cache.put(file_path, px, _encode(thumbnail), st)
+    return thumbnails
+
+
+def get_thumbnail(file_path, orientation=None, embedded_tags=(), px=PREVIEW_HEIGHT):
+    """Like load_preview, but served from and added to the thumbnail cache.
+
+    Only `px` is made on a miss, so a small embedded thumbnail can still be
+    used; prefetch() adds the other THUMBNAIL_SIZES later.
+    """
+    image = _cached(file_path, px)
+    if image is not None:
+        return image
+    return _make_thumbnails(file_path, (px,), orientation, embedded_tags)[px]
+
+
+def _read_orientation(file_path):
+    if not file_path.lower().endswith((".jpg", ".jpeg")):
+        return None
+    try:
+        metadata, _ = fastexif.read_jpeg(file_path, strict=False)
+    except (fastexif.Unsupported, OSError, ValueError):
+        return None
+    return metadata.get("Orientation")
+
+
+def prefetch(file_paths, token=None):
+    """Fill the thumbnail cache for `file_paths` in the background.
+
+    Stops early once `token` (a loader.CancelToken) is cancelled.
+    """
+    thumbnail_cache = get_cache()
+    if thumbnail_cache is None:
+        return
+    for file_path in file_paths:
+        if token is not None and token.cancelled:
+            return
+        missing = [
+            px for px in THUMBNAIL_SIZES if not thumbnail_cache.contains(file_path, px)
+        ]
+        if not missing:
+            continue
+        try:
+            _make_thumbnails(file_path, missing, _read_orientation(file_path), ())
+        except (OSError, ValueError) as e:
+            logging.debug(f"Could not prefetch thumbnail of {file_path}: {e}")
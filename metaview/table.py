@@ -0,0 +1,185 @@
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt, QTimer
+from PyQt5.QtWidgets import (
+    QAbstractItemView,
+    QHeaderView,
+    QLineEdit,
+    QStyledItemDelegate,
+    QTableView,
+    QWidget,
+)
+
+HEADERS = ("Property", "Value")
+# rows handed to the view per fetchMore, small enough to stay within a frame
+CHUNK_SIZE = 100
+
+
+class PropertyTableModel(QAbstractTableModel):
+    """Two-column (property, value) model over one category's dict.
+
+    Edits are written straight back into that dict. Values that are
+    widgets (preview, globe) are shown with setIndexWidget by the view.
+    Rows are exposed CHUNK_SIZE at a time through canFetchMore/fetchMore.
+    """
+
+    def __init__(self, items, read_only_keys=(), parent=None):
+        super().__init__(parent)
+        self.items = items
+        self.keys = list(items)
+        self.read_only_keys = read_only_keys
+        self.loaded = min(len(self.keys), CHUNK_SIZE)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.loaded
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.loaded < len(self.keys)
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        count = min(CHUNK_SIZE, len(self.keys) - self.loaded)
+        self.beginInsertRows(QModelIndex(), self.loaded, self.loaded + count - 1)
+        self.loaded += count
+        self.endInsertRows()
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 2
+
+    def key(self, row):
+        return self.keys[row]
+
+    def value(self, row):
+        return self.items.get(self.keys[row])
+
+    def is_editable(self, row):
+        key = self.keys[row]
+        return key not in self.read_only_keys and not isinstance(
+            self.value(row), QWidget
+        )
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role in (Qt.DisplayRole, Qt.EditRole, Qt.ToolTipRole):
+            if index.column() == 0:
+                return str(self.key(index.row()))
+            value = self.value(index.row())
+            if isinstance(value, QWidget):
+                return None
+            return str(value)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return HEADERS[section]
+        return None
+
+    def flags(self, index):
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if index.isValid() and index.column() == 1 and self.is_editable(index.row()):
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if (
+            role != Qt.EditRole
+            or index.column() != 1
+            or not self.is_editable(index.row())
+        ):
+            return False
+        self.items[self.key(index.row())] = value
+        self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
+        return True
+
+    def row_of(self, key):
+        """Row of `key`, -1 if it isn't there or not fetched yet."""
+        try:
+            row = self.keys.index(key)
+        except ValueError:
+            return -1
+        return row if row < self.loaded else -1
+
+    def refresh(self, key):
+        """Re-read `key` from the dict after it was changed from outside."""
+        row = self.row_of(key)
+        if row >= 0:
+            index = self.index(row, 1)
+            self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
+        return row
+
+
+class PropertyDelegate(QStyledItemDelegate):
+    """Inline QLineEdit editing, never for read-only properties."""
+
+    def createEditor(self, parent, option, index):
+        if not index.model().is_editable(index.row()):
+            return None
+        editor = QLineEdit(parent)
+        editor.setFrame(False)
+        return editor
+
+    def setEditorData(self, editor, index):
+        editor.setText(index.data(Qt.EditRole) or "")
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.text(), Qt.EditRole)
+
+
+class PropertyTable(QTableView):
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.setModel(model)
+        self.setItemDelegate(PropertyDelegate(self))
+        self.setEditTriggers(
+            QAbstractItemView.DoubleClicked | QAbstractItemView.EditKeyPressed
+        )
+        self.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setWordWrap(False)
+        self.setShowGrid(False)
+        self.setStyleSheet(
+            "QTableView::item { border-bottom: 1px solid gray; padding-left: 8px; }"
+        )
+
+        self.verticalHeader().hide()
+        self.verticalHeader().setDefaultSectionSize(32)
+        header = self.horizontalHeader()
+        header.setStyleSheet("font-weight: bold; font-size: 15px;")
+        header.setDefaultAlignment(Qt.AlignLeft | Qt.AlignVCenter)
+        header.setSectionResizeMode(0, QHeaderView.Fixed)
+        header.setSectionResizeMode(1, QHeaderView.Stretch)
+        self.setColumnWidth(0, 200)
+
+        for row in range(model.rowCount()):
+            self.show_widget(row)
+        model.rowsInserted.connect(self.on_rows_inserted)
+
+        # hand the remaining rows over one chunk per event loop pass
+        self.fetch_timer = QTimer(self)
+        self.fetch_timer.setInterval(0)
+        self.fetch_timer.timeout.connect(self.fetch_chunk)
+        if model.canFetchMore():
+            self.fetch_timer.start()
+
+    def fetch_chunk(self):
+        model = self.model()
+        if model.canFetchMore():
+            model.fetchMore()
+        if not model.canFetchMore():
+            self.fetch_timer.stop()
+
+    def on_rows_inserted(self, parent, first, last):
+        for row in range(first, last + 1):
+            self.show_widget(row)
+
+    def show_widget(self, row):
+        """Embed the row's value if it is a widget, sized to its maximum height."""
+        value = self.model().value(row)
+        if isinstance(value, QWidget):
+            self.setIndexWidget(self.model().index(row, 1), value)
+            height = value.maximumHeight()
+            self.setRowHeight(row, max(32, min(height, 256)))
+        elif self.indexWidget(self.model().index(row, 1)) is not None:
+            self.setIndexWidget(self.model().index(row, 1), None)
+            self.setRowHeight(row, 32)
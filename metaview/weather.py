@@ -1,119 +1,726 @@
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date as Date
 from datetime import datetime, timedelta
 
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
-from . import extra_data
+from . import cache, extra_data
 
+FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
+HOURLY = ("temperature_2m", "weather_code")
+# longest date span asked for in one archive request
+ARCHIVE_MAX_DAYS = 366
+# open-meteo answers for the model cell around a point, so nearby photos share
+# cached data; 0.1 degrees is about the resolution of its archive
+WEATHER_GRID = 0.1
+# forecast data (including its past days) is refetched after this many seconds
+FORECAST_TTL = 60 * 60
+# keep fetched weather across runs
+CACHE_ENABLED = True
+# a gridded dataset placed here is used instead of open-meteo (see GridBackend)
+GRID_DIR = os.path.join(cache.CACHE_DIR, "weather_grid")
 
-def get_weather(date_str, lat, lon):
+# open-meteo's free tier allows 600 calls a minute, stay well below that
+RATE_LIMIT = 5.0
+RATE_BURST = 10
+MAX_CONNECTIONS = 4
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+# longest Retry-After honoured, in seconds
+MAX_RETRY_AFTER = 30
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_cache = None
+_cache_lock = threading.Lock()
+# series fetched this session, (cell, date, kind) -> (time.monotonic(), day);
+# lets a cell's forecast serve nearby photos even with CACHE_ENABLED off
+_recent = {}
+_recent_lock = threading.Lock()
+_client = None
+_backend = None
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions a second on average, bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RequestCancelled(requests.exceptions.RequestException):
+    """The load a request was made for has been cancelled."""
+
+
+class _Abort:
+    """Sockets of the request a thread has in flight, shut down on cancel.
+
+    Shutting a socket down makes a read blocked on it fail at once, which
+    closing it from another thread doesn't.
+    """
+
+    def __init__(self):
+        self.aborted = False
+        self._sockets = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _shutdown(sock):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def add(self, sock):
+        with self._lock:
+            self._sockets.append(sock)
+            aborted = self.aborted
+        if aborted:
+            self._shutdown(sock)
+
+    def __call__(self):
+        with self._lock:
+            self.aborted = True
+            sockets = list(self._sockets)
+        for sock in sockets:
+            self._shutdown(sock)
+
+
+# the _Abort of the request running on this thread, if it can be cancelled
+_in_flight = threading.local()
+
+
+class _AbortableMixin:
+    def getresponse(self, *args, **kwargs):
+        abort = getattr(_in_flight, "abort", None)
+        if abort is not None and self.sock is not None:
+            abort.add(self.sock)
+        return super().getresponse(*args, **kwargs)
+
+
+class _HTTPConnection(_AbortableMixin, HTTPConnection):
+    pass
+
+
+class _HTTPSConnection(_AbortableMixin, HTTPSConnection):
+    pass
+
+
+class _HTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _HTTPConnection
+
+
+class _HTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+
+class _AbortableAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections can be aborted from another thread."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _HTTPConnectionPool,
+            "https": _HTTPSConnectionPool,
+        }
+
+
+class WeatherClient:
+    """HTTP client for open-meteo shared by all weather lookups.
+
+    Requests go through one pooled Session, at most `max_connections` at a
+    time and no faster than the token bucket allows. 429 and 5xx answers are
+    retried with jittered exponential backoff (or the server's Retry-After,
+    capped at MAX_RETRY_AFTER). A request made for a loader.CancelToken is
+    aborted as soon as the token is cancelled.
+    `base_url` serves both APIs from one place instead of open-meteo, e.g. a
+    local stand-in server answering /v1/forecast and /v1/archive.
+    `stats()` reports request counts, latency and throughput.
+    """
+
+    def __init__(
+        self,
+        rate=RATE_LIMIT,
+        burst=RATE_BURST,
+        max_connections=MAX_CONNECTIONS,
+        max_retries=MAX_RETRIES,
+        timeout=10,
+        base_url=None,
+    ):
+        self.base_url = base_url.rstrip("/") if base_url else None
+        if self.base_url:
+            self.forecast_url = f"{self.base_url}/v1/forecast"
+            self.archive_url = f"{self.base_url}/v1/archive"
+        else:
+            self.forecast_url = FORECAST_URL
+            self.archive_url = ARCHIVE_URL
+        self.session = requests.Session()
+        adapter = _AbortableAdapter(
+            pool_connections=max_connections, pool_maxsize=max_connections
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.bucket = TokenBucket(rate, burst)
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.latency = 0.0
+        self._started = None
+
+    def _record(self, start, error=False):
+        with self._lock:
+            if self._started is None:
+                self._started = start
+            self.requests += 1
+            self.errors += error
+            self.latency += time.monotonic() - start
+
+    def _backoff(self, attempt, retry_after=None, token=None):
+        with self._lock:
+            self.retries += 1
+        try:
+            delay = min(max(0.0, float(retry_after)), MAX_RETRY_AFTER)
+        except (TypeError, ValueError):
+            delay = RETRY_BACKOFF * 2**attempt * random.uniform(0.5, 1.5)
+        if token is None:
+            time.sleep(delay)
+        elif token.wait(delay):
+            raise RequestCancelled("request cancelled")
+
+    def _send(self, url, params, token):
+        if token is None:
+            return self.session.get(url, params=params, timeout=self.timeout)
+        abort = _Abort()
+        _in_flight.abort = abort
+        try:
+            with token.on_cancel(abort):
+                response = self.session.get(url, params=params, timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            if abort.aborted:
+                raise RequestCancelled("request cancelled")
+            raise
+        finally:
+            _in_flight.abort = None
+        if abort.aborted:
+            raise RequestCancelled("request cancelled")
+        return response
+
+    def get(self, url, params, token=None):
+        """GET `url` and return the decoded JSON body.
+
+        Once `token` (a loader.CancelToken) is cancelled, the request in
+        flight is aborted, no further attempts or backoff happen and
+        RequestCancelled is raised.
+        """
+        with self._slots:
+            for attempt in range(self.max_retries + 1):
+                if token is not None and token.cancelled:
+                    raise RequestCancelled("request cancelled")
+                self.bucket.acquire()
+                start = time.monotonic()
+                try:
+                    response = self._send(url, params, token)
+                except requests.exceptions.RequestException:
+                    self._record(start, error=True)
+                    raise
+                retry = response.status_code in RETRY_STATUSES
+                self._record(start, error=retry)
+                if not retry:
+                    return response.json()
+                if attempt == self.max_retries:
+                    response.raise_for_status()
+                self._backoff(attempt, response.headers.get("Retry-After"), token)
+
+    def map(self, fn, *iterables):
+        """Run `fn` over `iterables` on up to max_connections threads, results in order."""
+        with ThreadPoolExecutor(
+            self.max_connections, thread_name_prefix="weather"
+        ) as executor:
+            return list(executor.map(fn, *iterables))
+
+    def stats(self):
+        with self._lock:
+            elapsed = (
+                time.monotonic() - self._started if self._started is not None else 0
+            )
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "errors": self.errors,
+                "mean_latency": self.latency / self.requests if self.requests else 0.0,
+                "throughput": self.requests / elapsed if elapsed else 0.0,
+            }
+
+    def close(self):
+        self.session.close()
+
+
+def get_client(base_url=None):
+    """Return the shared client, replacing it if `base_url` differs."""
+    global _client
+    old = None
+    with _cache_lock:
+        if (
+            _client is not None
+            and base_url
+            and _client.base_url != base_url.rstrip("/")
+        ):
+            old, _client = _client, None
+        if _client is None:
+            _client = WeatherClient(base_url=base_url)
+        client = _client
+    if old is not None:
+        old.close()
+    return client
+
+
+def get_cache():
+    global _cache, CACHE_ENABLED
+    if not CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = cache.WeatherCache()
+            except (OSError, sqlite3.Error) as e:
+                logging.warning(f"Weather cache unavailable: {e}")
+                CACHE_ENABLED = False
+        return _cache
+
+
+def _cell(lat, lon):
+    return round(lat / WEATHER_GRID), round(lon / WEATHER_GRID)
+
+
+def _cell_center(cell):
+    return cell[0] * WEATHER_GRID, cell[1] * WEATHER_GRID
+
+
+def _date_ranges(dates, max_days=ARCHIVE_MAX_DAYS):
+    """Merge ISO dates into (start, end) runs of consecutive days."""
+    ranges = []
+    for date in sorted(Date.fromisoformat(date) for date in dates):
+        if (
+            ranges
+            and date - ranges[-1][1] == timedelta(days=1)
+            and (date - ranges[-1][0]).days < max_days
+        ):
+            ranges[-1][1] = date
+        else:
+            ranges.append([date, date])
+    return [(start.isoformat(), end.isoformat()) for start, end in ranges]
+
+
+def _store_days(weather_cache, cell, kind, days):
+    if weather_cache is None:
+        return
+    for date, day in days.items():
+        # the archive leaves the last few days empty until they are final
+        if kind == "archive" and any(value is None for value in day["temperature_2m"]):
+            continue
+        weather_cache.put(cell, date, kind, day)
+
+
+def _remember(cell, kind, days):
+    now = time.monotonic()
+    with _recent_lock:
+        for key, (fetched, _) in list(_recent.items()):
+            if now - fetched > FORECAST_TTL:
+                del _recent[key]
+        for date, day in days.items():
+            _recent[(cell, date, kind)] = (now, day)
+
+
+def _recalled(cell, date, kind, max_age=None):
+    with _recent_lock:
+        entry = _recent.get((cell, date, kind))
+    if entry is None:
+        return None
+    fetched, day = entry
+    if max_age is not None and time.monotonic() - fetched > max_age:
+        return None
+    return day
+
+
+def _split_days(hourly):
+    """Split open-meteo's "hourly" block into one series per local date."""
+    days = {}
+    for i, timestamp in enumerate(hourly["time"]):
+        day = days.setdefault(
+            timestamp[:10], {"time": [], **{name: [] for name in HOURLY}}
+        )
+        day["time"].append(timestamp)
+        for name in HOURLY:
+            day[name].append(hourly[name][i])
+    return days
+
+
+def _get_day(url, params, kind, date, lat, lon, token=None, max_age=None):
+    """Hourly series of `date` at (lat, lon), from memory or the cache when possible.
+
+    Returns (day, reason): `day` is None when the API answered with an
+    error (`reason`) or didn't return that date.
+    """
+    cell = _cell(lat, lon)
+    day = _recalled(cell, date, kind, max_age)
+    if day is not None:
+        return day, None
+    weather_cache = get_cache()
+    if weather_cache is not None:
+        day = weather_cache.get(cell, date, kind, max_age)
+        if day is not None:
+            return day, None
+
+    data = get_client().get(url, params, token)
+    if "error" in data and data["error"]:
+        return None, data["reason"]
+
+    days = _split_days(data["hourly"])
+    _store_days(weather_cache, cell, kind, days)
+    _remember(cell, kind, days)
+    return days.get(date), "Not found"
+
+
+def _hour_index(day, dt):
+    """Position of the full hour `dt` in a day's series, None if it isn't there."""
+    times = day["time"]
+    if not times:
+        return None
+    timestamp = dt.strftime("%Y-%m-%dT%H:%M")
+    start = datetime.strptime(times[0], "%Y-%m-%dT%H:%M")
+    index = int((dt - start).total_seconds() // 3600)
+    if 0 <= index < len(times) and times[index] == timestamp:
+        return index
+    # days with a DST change have 23 or 25 hours
+    return times.index(timestamp) if timestamp in times else None
+
+
+def _describe(temperature, weather_code, hour):
+    temperature = str(temperature) + " °C"
+    if str(weather_code) in extra_data.weather_codes.keys():
+        # check if night or day
+        if 6 <= hour < 20:
+            weather_str = extra_data.weather_codes[str(weather_code)]["day"][
+                "description"
+            ]
+        else:
+            weather_str = extra_data.weather_codes[str(weather_code)]["night"][
+                "description"
+            ]
+    else:
+        weather_str = f"Weather code {str(weather_code)} not found. Please create an issue on GitHub."
+
+    return temperature, weather_str
+
+
+def get_weather(date_str, lat, lon, token=None):
     # convert so api can understand
     dt = datetime.strptime(date_str, "%Y:%m:%d %H:%M:%S")
-    if dt < datetime.now() - timedelta(days=7):
-        return get_historical(dt, lat, lon)
-    else:
-        return get_forecast(dt, lat, lon)
+    return get_backend().lookup(dt, lat, lon, token)
 
 
-def get_forecast(dt, lat, lon):
-    dt = dt.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+def get_weather_many(items, token=None):
+    """(temperature, weather) for each (datetime, lat, lon) item, in order."""
+    return get_backend().lookup_many(items, token)
 
-    url = "https://api.open-meteo.com/v1/forecast"
+
+def get_forecast(dt, lat, lon, token=None):
+    dt = dt.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    date = dt.strftime("%Y-%m-%d")
+    # ask for the cell the result is cached under, so it serves the whole cell
+    lat, lon = _cell_center(_cell(lat, lon))
 
     params = {
         "latitude": lat,
         "longitude": lon,
-        "hourly": ("temperature_2m", "weather_code"),
-        "past_days": "14",
-        "forecast_days": "2",
+        "hourly": HOURLY,
+        "start_date": date,
+        "end_date": date,
         "timezone": "auto",
     }
 
+    url = get_client().forecast_url
     try:
-        response = requests.get(url, params=params, timeout=10)
-        data = response.json()
-        if "error" in data and data["error"]:
-            return data["reason"], data["reason"]
-        else:
-            times = data["hourly"]["time"]
-            temps = data["hourly"]["temperature_2m"]
-            codes = data["hourly"]["weather_code"]
-
-            combined = [
-                {"time": t, "temperature_2m": temp, "weather_code": code}
-                for t, temp, code in zip(times, temps, codes)
-            ]
+        day, reason = _get_day(
+            url, params, "forecast", date, lat, lon, token, FORECAST_TTL
+        )
+        if day is None:
+            return reason, reason
 
-            success = False
-            for timeset in combined:
-                dt2 = datetime.strptime(timeset["time"], "%Y-%m-%dT%H:%M")
-                if dt2 == dt:
-                    temperature = str(timeset["temperature_2m"]) + " °C"
-                    weather_code = str(timeset["weather_code"])
-                    success = True
-                    break
-            if not success:
-                return "Not found", "Not found"
-
-        if str(weather_code) in extra_data.weather_codes.keys():
-            # check if night or day
-            if 6 <= dt.hour < 20:
-                weather_str = extra_data.weather_codes[str(weather_code)]["day"][
-                    "description"
-                ]
-            else:
-                weather_str = extra_data.weather_codes[str(weather_code)]["night"][
-                    "description"
-                ]
-        else:
-            weather_str = f"Weather code {str(weather_code)} not found. Please create an issue on GitHub."
+        index = _hour_index(day, dt)
+        if index is None:
+            return "Not found", "Not found"
 
-        return temperature, weather_str
+        return _describe(
+            day["temperature_2m"][index], day["weather_code"][index], dt.hour
+        )
     except requests.exceptions.RequestException as e:
         print(f"Network Error: {e}")
         return "Network Error", "Network Error"
 
 
-def get_historical(dt, lat, lon):
-    date = dt.strftime("%Y-%m-%d")
+def get_historical(dt, lat, lon, token=None):
+    return get_historical_many([(dt, lat, lon)], token)[0]
+
 
-    hour = int(dt.strftime("%H"))
+def _fetch_archive(cell, start, end, token=None):
+    """One archive request for `cell` from `start` to `end`.
 
-    url = "https://archive-api.open-meteo.com/v1/archive"
+    Returns ({date: hourly series}, reason for the dates it has no data for).
+    """
+    lat, lon = _cell_center(cell)
     params = {
         "latitude": lat,
         "longitude": lon,
-        "start_date": date,
-        "end_date": date,
-        "hourly": ("temperature_2m", "weather_code"),
+        "start_date": start,
+        "end_date": end,
+        "hourly": HOURLY,
         "timezone": "auto",
     }
     try:
-        response = requests.get(url, params=params, timeout=10)
-        data = response.json()
+        client = get_client()
+        data = client.get(client.archive_url, params, token)
+    except requests.exceptions.RequestException as e:
+        print(f"Network Error: {e}")
+        return {}, "Network Error"
+    if "error" in data and data["error"]:
+        return {}, data["reason"]
+    return _split_days(data["hourly"]), "Not found"
 
-        if "error" in data and data["error"]:
-            return data["reason"], data["reason"]
+
+def get_historical_many(items, token=None):
+    """Historical weather for many (datetime, lat, lon) at once.
+
+    Items are grouped by WEATHER_GRID cell and each cell's dates merged into
+    runs of consecutive days, so a run costs one archive request, or none
+    when it is cached. The requests run concurrently on the shared client.
+    Returns a (temperature, weather) pair per item.
+    """
+    items = list(items)
+    weather_cache = get_cache()
+    days = {}
+    wanted = {}
+    for dt, lat, lon in items:
+        key = (_cell(lat, lon), dt.strftime("%Y-%m-%d"))
+        if key in days or key[1] in wanted.get(key[0], ()):
+            continue
+        day = weather_cache.get(*key, "archive") if weather_cache is not None else None
+        if day is not None:
+            days[key] = day
         else:
-            temperature = str(data["hourly"]["temperature_2m"][hour]) + " °C"
-            weather_code = str(data["hourly"]["weather_code"][hour])
-
-        if str(weather_code) in extra_data.weather_codes.keys():
-            # check if night or day
-            if 6 <= hour < 20:
-                weather_str = extra_data.weather_codes[str(weather_code)]["day"][
-                    "description"
-                ]
-            else:
-                weather_str = extra_data.weather_codes[str(weather_code)]["night"][
-                    "description"
-                ]
+            wanted.setdefault(key[0], set()).add(key[1])
+
+    runs = [
+        (cell, start, end)
+        for cell, dates in wanted.items()
+        for start, end in _date_ranges(dates)
+    ]
+    responses = get_client().map(lambda run: _fetch_archive(*run, token), runs)
+
+    reasons = {}
+    for (cell, start, end), (fetched, reason) in zip(runs, responses):
+        _store_days(weather_cache, cell, "archive", fetched)
+        for date, day in fetched.items():
+            days[(cell, date)] = day
+        for date in wanted[cell]:
+            if start <= date <= end:
+                reasons[(cell, date)] = reason
+
+    results = []
+    for dt, lat, lon in items:
+        key = (_cell(lat, lon), dt.strftime("%Y-%m-%d"))
+        day = days.get(key)
+        if day is None:
+            reason = reasons.get(key, "Not found")
+            results.append((reason, reason))
+            continue
+        index = _hour_index(day, dt.replace(minute=0, second=0, microsecond=0))
+        if index is None:
+            results.append(("Not found", "Not found"))
+            continue
+        results.append(
+            _describe(day["temperature_2m"][index], day["weather_code"][index], dt.hour)
+        )
+    return results
+
+
+class WeatherBackend:
+    """Where weather comes from.
+
+    Subclasses implement `lookup_many`; both methods return (temperature,
+    weather) strings. `token`, a loader.CancelToken, only matters to backends
+    that go online.
+    """
+
+    def lookup(self, dt, lat, lon, token=None):
+        return self.lookup_many([(dt, lat, lon)], token)[0]
+
+    def lookup_many(self, items, token=None):
+        raise NotImplementedError
+
+
+class OpenMeteoBackend(WeatherBackend):
+    """The open-meteo forecast API for the last week, its archive before that."""
+
+    def lookup(self, dt, lat, lon, token=None):
+        if dt < datetime.now() - timedelta(days=7):
+            return get_historical(dt, lat, lon, token)
         else:
-            weather_str = f"Weather code {str(weather_code)} not found. Please create an issue on GitHub."
+            return get_forecast(dt, lat, lon, token)
 
-        return temperature, weather_str
-    except requests.exceptions.RequestException as e:
-        print(f"Network Error: {e}")
-        return "Network Error", "Network Error"
+    def lookup_many(self, items, token=None):
+        items = list(items)
+        cutoff = datetime.now() - timedelta(days=7)
+        results = [None] * len(items)
+        historical = [i for i, (dt, _, _) in enumerate(items) if dt < cutoff]
+        responses = get_historical_many([items[i] for i in historical], token)
+        for i, result in zip(historical, responses):
+            results[i] = result
+        for i, (dt, lat, lon) in enumerate(items):
+            if results[i] is None:
+                results[i] = get_forecast(dt, lat, lon, token)
+        return results
+
+
+class GridBackend(WeatherBackend):
+    """Weather from a local gridded dataset, without any network access.
+
+    `path` is a directory holding temperature_2m.npy and weather_code.npy,
+    both shaped (time, lat, lon) and memory-mapped, and grid.json describing
+    their axes: {"start": "2024-01-01T00:00", "step_hours": 1, "lat0": -90,
+    "lat_step": 0.25, "lon0": -180, "lon_step": 0.25}. Photo times are
+    matched as they are, so like the API's "timezone=auto" answers the time
+    axis has to be local time. A lon axis covering all 360 degrees wraps
+    around, missing values may be NaN in either array. Points and times
+    outside the grid are looked up with `fallback`, a WeatherBackend, if
+    one is given.
+    """
+
+    def __init__(self, path=GRID_DIR, fallback=None):
+        self.fallback = fallback
+        with open(os.path.join(path, "grid.json"), encoding="utf-8") as f:
+            grid = json.load(f)
+        self.start = np.datetime64(grid["start"], "s")
+        self.step = np.timedelta64(int(grid.get("step_hours", 1) * 3600), "s")
+        self.lat0, self.lat_step = grid["lat0"], grid["lat_step"]
+        self.lon0, self.lon_step = grid["lon0"], grid["lon_step"]
+        self.temperature = np.load(
+            os.path.join(path, "temperature_2m.npy"), mmap_mode="r"
+        )
+        self.weather_code = np.load(
+            os.path.join(path, "weather_code.npy"), mmap_mode="r"
+        )
+        if (
+            self.temperature.ndim != 3
+            or self.temperature.shape != self.weather_code.shape
+        ):
+            raise ValueError(
+                "temperature_2m and weather_code must share a (time, lat, lon) shape"
+            )
+        self.wrap_lon = abs(self.temperature.shape[2] * self.lon_step - 360) < 1e-6
+
+    def cells(self, items):
+        """Nearest (time, lat, lon) indices per item and a mask of those inside the grid."""
+        times = np.array([dt for dt, _, _ in items], dtype="datetime64[s]")
+        coords = np.array([(lat, lon) for _, lat, lon in items], dtype=float).reshape(
+            -1, 2
+        )
+        t = ((times - self.start) // self.step).astype(np.int64)
+        lat = np.rint((coords[:, 0] - self.lat0) / self.lat_step).astype(np.int64)
+        lon = np.rint((coords[:, 1] - self.lon0) / self.lon_step).astype(np.int64)
+        if self.wrap_lon:
+            # 179.9 is nearest to the -180 column
+            lon %= self.temperature.shape[2]
+        inside = np.ones(len(items), dtype=bool)
+        for index, size in zip((t, lat, lon), self.temperature.shape):
+            inside &= (index >= 0) & (index < size)
+        return (t, lat, lon), inside
+
+    def lookup_many(self, items, token=None):
+        items = list(items)
+        if not items:
+            return []
+        (t, lat, lon), inside = self.cells(items)
+        temperatures = np.full(len(items), np.nan)
+        codes = np.full(len(items), np.nan)
+        temperatures[inside] = self.temperature[t[inside], lat[inside], lon[inside]]
+        codes[inside] = self.weather_code[t[inside], lat[inside], lon[inside]]
+        found = np.isfinite(temperatures) & np.isfinite(codes)
+
+        results = []
+        for (dt, _, _), temperature, code, ok in zip(
+            items, temperatures.tolist(), codes.tolist(), found.tolist()
+        ):
+            if not ok:
+                results.append(("Not found", "Not found"))
+            else:
+                results.append(_describe(round(temperature, 1), int(code), dt.hour))
+
+        outside = np.flatnonzero(~inside).tolist()
+        if self.fallback is not None and outside:
+            fetched = self.fallback.lookup_many([items[i] for i in outside], token)
+            for i, result in zip(outside, fetched):
+                results[i] = result
+        return results
+
+
+def get_backend():
+    """The backend set with set_backend, otherwise the local grid if one is installed.
+
+    Open-meteo serves whatever the grid doesn't cover.
+    """
+    global _backend
+    with _cache_lock:
+        if _backend is None:
+            if os.path.exists(os.path.join(GRID_DIR, "grid.json")):
+                try:
+                    _backend = GridBackend(GRID_DIR, fallback=OpenMeteoBackend())
+                except (OSError, ValueError, KeyError) as e:
+                    logging.warning(f"Could not load weather grid from {GRID_DIR}: {e}")
+            if _backend is None:
+                _backend = OpenMeteoBackend()
+        return _backend
+
+
+def set_backend(backend):
+    global _backend
+    with _cache_lock:
+        _backend = backend
 
 
 if __name__ == "__main__":
@@ -0,0 +1,146 @@
+import os
+import shutil
+
+import pytest
+
+from metaview import exiftool, fastexif
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+# tags as exiftool prints them for the samples (made with Pillow, see the
+# EXIF written there), the file system tags differ per checkout
+EXIF = {
+    "Make": "Canon",
+    "Model": "Canon EOS 5D",
+    "Orientation": "Rotate 90 CW",
+    "XResolution": 72,
+    "YResolution": 72,
+    "ResolutionUnit": "inches",
+    "Software": "MetaView tests",
+    "ModifyDate": "2022:08:14 12:30:00",
+    "DateTimeOriginal": "2022:08:14 12:30:00",
+    "ExposureTime": "1/250",
+    "FNumber": 2.8,
+    "ISO": 100,
+    "Flash": "Off, Did not fire",
+    "FocalLength": "50.0 mm",
+    "GPSVersionID": "2.3.0.0",
+    "GPSLatitudeRef": "North",
+    "GPSLatitude": "43 deg 30' 0.00\" N",
+    "GPSLongitudeRef": "West",
+    "GPSLongitude": "11 deg 54' 0.00\" W",
+    "GPSPosition": "43 deg 30' 0.00\" N, 11 deg 54' 0.00\" W",
+    "ImageWidth": 32,
+    "ImageHeight": 24,
+    "ImageSize": "32x24",
+    "Aperture": 2.8,
+    "ShutterSpeed": "1/250",
+    "LightValue": 10.9,
+}
+JPEG = {
+    **EXIF,
+    "FileType": "JPEG",
+    "MIMEType": "image/jpeg",
+    "JFIFVersion": 1.01,
+    "EncodingProcess": "Baseline DCT, Huffman coding",
+    "BitsPerSample": 8,
+    "ColorComponents": 3,
+    "YCbCrSubSampling": "YCbCr4:2:0 (2 2)",
+}
+PNG = {
+    **EXIF,
+    "FileType": "PNG",
+    "MIMEType": "image/png",
+    "BitDepth": 8,
+    "ColorType": "RGB",
+    "Compression": "Deflate/Inflate",
+    "Filter": "Adaptive",
+    "Interlace": "Noninterlaced",
+    "Title": "Sample",
+    "Comment": "compressed " * 10,
+    "PixelsPerUnitX": 2835,
+    "PixelsPerUnitY": 2835,
+    "PixelUnits": "meters",
+}
+# reading these changes the access time exiftool would report
+VOLATILE = {"FileAccessDate"}
+
+
+def sample(name):
+    return os.path.join(DATA, name)
+
+
+def read(file_path):
+    if file_path.endswith(".png"):
+        return fastexif.read_png(file_path, inflate=True)
+    metadata, _ = fastexif.read_jpeg(file_path)
+    return metadata
+
+
+@pytest.mark.parametrize("name, expected", [("exif.jpg", JPEG), ("text.png", PNG)])
+def test_read(name, expected):
+    metadata = read(sample(name))
+    assert metadata["SourceFile"] == sample(name)
+    assert {key: metadata.get(key) for key in expected} == expected
+
+
+def test_compressed_text_is_a_placeholder_unless_inflated():
+    metadata = fastexif.read_png(sample("text.png"))
+    assert metadata["Comment"].startswith("(Compressed text, ")
+
+
+@pytest.mark.parametrize("name", ["makernote.jpg", "xmp.png"])
+def test_unsupported(name):
+    with pytest.raises(fastexif.Unsupported):
+        read(sample(name))
+
+
+def test_makernote_is_skipped_when_not_strict():
+    metadata, _ = fastexif.read_jpeg(sample("makernote.jpg"), strict=False)
+    assert metadata["Make"] == "Canon"
+    assert "MakerNote" not in metadata
+
+
+def test_get_metadata_falls_back_to_exiftool(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        exiftool,
+        "get_metadata",
+        lambda path: calls.append(path) or {"SourceFile": path},
+    )
+    assert fastexif.get_metadata(sample("exif.jpg"))["Make"] == "Canon"
+    assert calls == []
+    fastexif.get_metadata(sample("makernote.jpg"))
+    assert calls == [sample("makernote.jpg")]
+
+
+def test_get_metadata_many_batches_the_leftovers(monkeypatch):
+    batches = []
+
+    def get_metadata_many(paths):
+        batches.append(list(paths))
+        return {path: {"SourceFile": path} for path in paths}
+
+    monkeypatch.setattr(exiftool, "get_metadata_many", get_metadata_many)
+    names = ["exif.jpg", "makernote.jpg", "text.png", "xmp.png"]
+    results = fastexif.get_metadata_many([sample(name) for name in names])
+    assert batches == [[sample("makernote.jpg"), sample("xmp.png")]]
+    assert set(results) == {sample(name) for name in names}
+    assert results[sample("text.png")]["Title"] == "Sample"
+
+
+@pytest.fixture
+def real_exiftool(monkeypatch):
+    if shutil.which("exiftool") is None:
+        pytest.skip("exiftool is not installed")
+    monkeypatch.setattr(exiftool, "CACHE_ENABLED", False)
+    yield
+    exiftool.shutdown()
+
+
+@pytest.mark.parametrize("name", ["exif.jpg", "text.png"])
+def test_matches_exiftool(real_exiftool, name):
+    metadata = read(sample(name))
+    expected = exiftool.get_metadata(sample(name))
+    for key in set(metadata) - VOLATILE:
+        assert metadata[key] == expected.get(key), key
@@ -0,0 +1,174 @@
+import json
+import threading
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pytest
+
+from metaview import cache, weather
+
+
+class ArchiveHandler(BaseHTTPRequestHandler):
+    """Stand-in for open-meteo: hour h of day d is h + d/100 degrees."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        self.server.requests.append((url.path, query))
+        day = date.fromisoformat(query["start_date"][0])
+        end = date.fromisoformat(query["end_date"][0])
+        hourly = {"time": [], "temperature_2m": [], "weather_code": []}
+        while day <= end:
+            for hour in range(24):
+                hourly["time"].append(f"{day.isoformat()}T{hour:02d}:00")
+                hourly["temperature_2m"].append(hour + day.day / 100)
+                hourly["weather_code"].append(3)
+            day += timedelta(days=1)
+        body = json.dumps({"hourly": hourly}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch, tmp_path):
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ArchiveHandler)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    client = weather.WeatherClient(
+        rate=1000, burst=1000, base_url=f"http://127.0.0.1:{httpd.server_port}"
+    )
+    monkeypatch.setattr(weather, "_client", client)
+    monkeypatch.setattr(weather, "CACHE_ENABLED", True)
+    monkeypatch.setattr(
+        weather, "_cache", cache.WeatherCache(str(tmp_path / "weather.sqlite"))
+    )
+    yield httpd
+    client.close()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_archive_runs_are_batched_and_cached(server):
+    start = datetime(2020, 1, 1, 12)
+    items = [(start + timedelta(days=i), 43.5, -11.9) for i in range(501)]
+
+    results = weather.get_historical_many(items)
+    assert len(server.requests) == 2
+    assert all(path == "/v1/archive" for path, _ in server.requests)
+    # ARCHIVE_MAX_DAYS (366) in one request, the rest in a second one
+    runs = sorted(
+        (query["start_date"][0], query["end_date"][0]) for _, query in server.requests
+    )
+    assert runs == [("2020-01-01", "2020-12-31"), ("2021-01-01", "2021-05-15")]
+    assert results[0] == weather._describe(12.01, 3, 12)
+    assert results[-1] == weather._describe(12.15, 3, 12)
+
+    assert weather.get_historical_many(items) == results
+    assert len(server.requests) == 2
+
+
+def test_duplicates_share_a_request(server):
+    when = datetime(2021, 6, 1, 8)
+    items = [
+        (when, 43.5, -11.9),
+        (when.replace(hour=20), 43.51, -11.91),
+        (when, 43.5, -11.9),
+        (when, 10.0, 10.0),
+    ]
+    results = weather.get_historical_many(items)
+    assert len(server.requests) == 2
+    assert results[0] == results[2] == results[3] == weather._describe(8.01, 3, 8)
+    assert results[1] == weather._describe(20.01, 3, 20)
+
+
+def test_forecast_is_reused_per_cell_without_the_disk_cache(server, monkeypatch):
+    monkeypatch.setattr(weather, "CACHE_ENABLED", False)
+    monkeypatch.setattr(weather, "_recent", {})
+    when = datetime(2024, 3, 1, 10, 20)
+
+    first = weather.get_forecast(when, 43.5, -11.9)
+    assert weather.get_forecast(when, 43.51, -11.91) == first
+    assert [path for path, _ in server.requests] == ["/v1/forecast"]
+    # the next full hour is reported
+    assert first == weather._describe(11.01, 3, 11)
+
+    weather.get_forecast(when, 10.0, 10.0)
+    assert len(server.requests) == 2
+
+
+class RecordingBackend(weather.WeatherBackend):
+    def __init__(self):
+        self.items = []
+
+    def lookup_many(self, items, token=None):
+        self.items.extend(items)
+        return [("online", "online")] * len(items)
+
+
+@pytest.fixture
+def grid(tmp_path):
+    """A global 10 degree grid over 4 hours, temperature = lat index + hour."""
+    shape = (4, 19, 36)
+    temperature = np.zeros(shape, dtype=np.float32)
+    temperature += np.arange(shape[0])[:, None, None]
+    temperature += np.arange(shape[1])[None, :, None]
+    codes = np.full(shape, 3, dtype=np.float32)
+    # lat index 9 is the equator, lon index 18 is 0 degrees
+    temperature[1, 9, 18] = np.nan
+    codes[2, 9, 18] = np.nan
+    np.save(tmp_path / "temperature_2m.npy", temperature)
+    np.save(tmp_path / "weather_code.npy", codes)
+    (tmp_path / "grid.json").write_text(
+        json.dumps(
+            {
+                "start": "2024-01-01T00:00",
+                "step_hours": 1,
+                "lat0": -90,
+                "lat_step": 10,
+                "lon0": -180,
+                "lon_step": 10,
+            }
+        )
+    )
+    return weather.GridBackend(str(tmp_path), fallback=RecordingBackend())
+
+
+def test_grid_wraps_longitude(grid):
+    when = datetime(2024, 1, 1, 0)
+    (_, _, lon), inside = grid.cells([(when, 0, 178), (when, 0, -180), (when, 0, 184)])
+    assert lon.tolist() == [0, 0, 0]
+    assert inside.all()
+    assert grid.lookup_many([(when, 0, 178)]) == [weather._describe(9.0, 3, 0)]
+    assert grid.fallback.items == []
+
+
+def test_grid_masks_missing_values(grid):
+    items = [(datetime(2024, 1, 1, hour), 0, 0) for hour in range(4)]
+    assert grid.lookup_many(items) == [
+        weather._describe(9.0, 3, 0),
+        ("Not found", "Not found"),
+        ("Not found", "Not found"),
+        weather._describe(12.0, 3, 3),
+    ]
+    assert grid.fallback.items == []
+
+
+def test_grid_falls_back_outside_its_coverage(grid):
+    inside = (datetime(2024, 1, 1, 1), 10, 20)
+    before = (datetime(2023, 12, 31, 23), 10, 20)
+    after = (datetime(2024, 1, 1, 4), 10, 20)
+    assert grid.lookup_many([before, inside, after]) == [
+        ("online", "online"),
+        weather._describe(11.0, 3, 1),
+        ("online", "online"),
+    ]
+    assert grid.fallback.items == [before, after]